@@ -0,0 +1,98 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import numpy as np
+import reversi
+
+
+# Positions are arrays of shape (N, 2) holding the black and white disc
+# masks of N boards as uint64, or (N, 64) arrays of cells holding BLACK,
+# WHITE or 0, with square 8 * x + y at index 8 * x + y.
+
+CORNERS = np.uint64(reversi.CORNERS)
+CLOSE_TO_CORNERS = np.uint64(reversi.CLOSE_TO_CORNERS)
+SHIFTS = [(np.uint64(shift), np.uint64(mask))
+          for (shift, mask) in reversi.SHIFTS]
+
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)],
+                        dtype=np.int64)
+
+
+def popcount(a):
+    # Number of set bits of each element of a uint64 array
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(a).astype(np.int64)
+    a = np.ascontiguousarray(a, dtype=np.uint64)
+    return _BYTE_COUNTS[a.view(np.uint8).reshape(a.shape + (8,))].sum(-1)
+
+
+def bitmasks(positions):
+    # Return positions as an (N, 2) uint64 array of disc masks
+    positions = np.asarray(positions)
+    if positions.shape[1] == 2:
+        return positions.astype(np.uint64)
+    weights = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+    black = np.bitwise_or.reduce(
+        np.where(positions == reversi.BLACK, weights, np.uint64(0)), axis=1)
+    white = np.bitwise_or.reduce(
+        np.where(positions == reversi.WHITE, weights, np.uint64(0)), axis=1)
+    return np.stack([black, white], axis=1)
+
+
+def from_boards(boards):
+    # Return the positions of Board or BitBoard objects as an (N, 2) array
+    return np.array([board.bitmasks() for board in boards], dtype=np.uint64)
+
+
+def legal_moves(own, other):
+    # reversi.legal_moves over arrays of masks
+    empty = ~(own | other)
+    moves = np.zeros_like(own)
+    for (shift, mask) in SHIFTS:
+        o = other & mask
+        t = o & (own << shift)
+        for i in range(5):
+            t |= o & (t << shift)
+        moves |= empty & (t << shift)
+        t = o & (own >> shift)
+        for i in range(5):
+            t |= o & (t >> shift)
+        moves |= empty & (t >> shift)
+    return moves
+
+
+def _ratio(x, y):
+    # 100 * x / (x + y) if x > y, -100 * y / (x + y) if x < y, else 0
+    total = np.where(x + y == 0, 1, x + y)
+    return np.where(x > y, 100 * x / total,
+                    np.where(x < y, -100 * y / total, 0.0))
+
+
+def evaluate(positions, player):
+    # Return Board.evaluate(player) of every position as a float64 array;
+    # `player` is BLACK, WHITE or an array of them, one per position
+    masks = bitmasks(positions)
+    (black, white) = (masks[:, 0], masks[:, 1])
+    player = np.broadcast_to(np.asarray(player), black.shape)
+    own = np.where(player == reversi.BLACK, black, white)
+    other = np.where(player == reversi.BLACK, white, black)
+
+    own_moves = popcount(legal_moves(own, other))
+    other_moves = popcount(legal_moves(other, own))
+    x = popcount(own)
+    y = popcount(other)
+
+    # Piece difference
+    p = _ratio(x, y)
+
+    # Corner occupancy
+    c = 25 * (popcount(own & CORNERS) - popcount(other & CORNERS))
+
+    # Corner closeness
+    l = -12.5 * (popcount(own & CLOSE_TO_CORNERS) -
+                 popcount(other & CLOSE_TO_CORNERS))
+
+    # Mobility
+    m = _ratio(own_moves, other_moves)
+
+    over = (own_moves == 0) & (other_moves == 0)
+    return np.where(over, (x - y) * float(reversi.WIN_SCORE), p + c + l + m)
@@ -0,0 +1,251 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import reversi
+
+
+# Perft node counts of the start position. Passes count as a move and
+# finished games as a single leaf.
+START_PERFT = [4, 12, 56, 244, 1396, 8200, 55092, 390216, 3005288]
+
+# Midgame and endgame positions, given as the moves leading to them, with
+# their perft counts from depth 1 up
+CORPUS = [
+    ('d3c3b3b2c4a3c2e3a1b4f6c1d2e6a5d1f4f3g3h3',
+     [8, 79, 676, 6472, 62664, 616409]),
+    ('d3c3b3b2c4c5e6f6g6b4a1e3a4g7h8c2a2a3d2f4b5d6a5c1',
+     [10, 80, 882, 8261, 91331, 944844]),
+    ('d3c3b3b2c4a3c2e3a1b4f6c1d2e6a5d1f4f3g3h3f2e2a2a4b5c5b6f1e1g2h2g5f5g4'
+     'g6d6',
+     [8, 106, 762, 9669, 71721, 854382]),
+    ('d3c3b3b2c4c5e6f6g6b4a1e3a4g7h8c2a2a3d2f4b5d6a5c1g4f5b1g5h5h6d1a6a7c6'
+     'b6f3h7e1f7e7f1f8g8g3',
+     [9, 31, 253, 1119, 8026, 38859]),
+    ('d3c3b3b2c4a3c2e3a1b4f6c1d2e6a5d1f4f3g3h3f2e2a2a4b5c5b6f1e1g2h2g5f5g4'
+     'g6d6h4h5c7c6h6a6a7h1f7d7c8e7',
+     [6, 53, 256, 1776, 7622, 40955])
+]
+
+
+def position(moves, backend='bitboard'):
+    # Play a move string such as 'f5d6c3' from the start and return the
+    # board and the player to move; passes are implied
+    board = reversi.BACKENDS[backend]()
+    player = reversi.BLACK
+    for i in range(0, len(moves), 2):
+        pos = reversi.parse_square(moves[i:i + 2])
+        if not board.is_valid(player, pos):
+            player = reversi.opp(player)
+        board.move(player, pos)
+        player = reversi.opp(player)
+    if not board.avl_moves(player):
+        player = reversi.opp(player)
+    return (board, player)
+
+
+def perft(board, player, depth):
+    # Count the leaves of the game tree `depth` plies deep
+    if depth == 0:
+        return 1
+    moves = board.avl_moves(player)
+    if not moves:
+        if not board.avl_moves(reversi.opp(player)):
+            return 1
+        return perft(board, reversi.opp(player), depth - 1)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for pos in moves:
+        flipped = board.make_move(player, pos)
+        nodes += perft(board, reversi.opp(player), depth - 1)
+        board.unmake_move(player, pos, flipped)
+    return nodes
+
+
+def positions(backend='bitboard', count=200, seed=1):
+    # Return (board, player) pairs reached by random play from the start
+    rng = random.Random(seed)
+    result = []
+    while len(result) < count:
+        board = reversi.BACKENDS[backend]()
+        player = reversi.BLACK
+        for ply in range(rng.randrange(4, 56)):
+            moves = board.avl_moves(player)
+            if not moves:
+                if not board.avl_moves(reversi.opp(player)):
+                    break
+                player = reversi.opp(player)
+                continue
+            board.move(player, rng.choice(moves))
+            player = reversi.opp(player)
+        result.append((board, player))
+    return result
+
+
+def rate(func, boards, seconds):
+    # Return calls per second of func(board, player) over `boards`
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for (board, player) in boards:
+            func(board, player)
+        calls += len(boards)
+    return calls / (time.perf_counter() - start)
+
+
+def bench_perft(backend, start_depth, corpus_depth):
+    results = []
+    cases = [('start', START_PERFT[:start_depth])]
+    cases += [(moves, counts[:corpus_depth]) for (moves, counts) in CORPUS]
+    for (moves, counts) in cases:
+        (board, player) = position('' if moves == 'start' else moves,
+                                   backend)
+        depth = len(counts)
+        start = time.perf_counter()
+        nodes = perft(board, player, depth)
+        seconds = time.perf_counter() - start
+        results.append({
+            'position': moves,
+            'name': 'start' if moves == 'start' else
+                    'ply {}'.format(len(moves) // 2),
+            'depth': depth,
+            'nodes': nodes,
+            'expected': counts[-1],
+            'ok': nodes == counts[-1],
+            'seconds': seconds,
+            'nodes_per_second': nodes / seconds
+        })
+    return results
+
+
+def bench_levels(backend, levels):
+    # Time Game.get_move at each level on every corpus position
+    results = {}
+    for level in levels:
+        times = []
+        for (moves, counts) in CORPUS:
+            (board, player) = position(moves, backend)
+            game = reversi.Game(human=reversi.opp(player), algorithm=level,
+                                backend=backend)
+            game.board = board
+            game.player = player
+            start = time.perf_counter()
+            game.get_move()
+            times.append(time.perf_counter() - start)
+        results[level] = {
+            'mean_seconds': sum(times) / len(times),
+            'max_seconds': max(times)
+        }
+    return results
+
+
+def bench_depths(backend, depth):
+    # Search every corpus position to a fixed depth, with and without move
+    # ordering, and count nodes
+    results = []
+    for ordering in (False, True):
+        nodes = 0
+        start = time.perf_counter()
+        for (moves, counts) in CORPUS:
+            (board, player) = position(moves, backend)
+            search = reversi.Search(board, reversi.TranspositionTable(),
+                                    ordering)
+            search.best_move(player, depth)
+            nodes += search.nodes
+        seconds = time.perf_counter() - start
+        results.append({
+            'depth': depth,
+            'ordering': ordering,
+            'nodes': nodes,
+            'seconds': seconds,
+            'nodes_per_second': nodes / seconds
+        })
+    return results
+
+
+def run(backend='bitboard', start_depth=7, corpus_depth=4, search_depth=4,
+        levels=('easy', 'medium', 'hard'), seconds=1.0):
+    boards = positions(backend)
+    return {
+        'backend': backend,
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'perft': bench_perft(backend, start_depth, corpus_depth),
+        'avl_moves_per_second': rate(
+            lambda board, player: board.avl_moves(player), boards, seconds),
+        'evaluate_per_second': rate(
+            lambda board, player: board.evaluate(player), boards, seconds),
+        'search': bench_depths(backend, search_depth),
+        'levels': bench_levels(backend, levels)
+    }
+
+
+def compare(old, new):
+    # Print the ratio new/old of each throughput figure of two runs
+    def ratio(a, b):
+        return '{:.2f}x'.format(b / a) if a else 'n/a'
+
+    for (a, b) in zip(old['perft'], new['perft']):
+        print('perft {:>6} d{}: {}'.format(
+            a['name'], a['depth'],
+            ratio(a['nodes_per_second'], b['nodes_per_second'])))
+    for key in ('avl_moves_per_second', 'evaluate_per_second'):
+        print('{}: {}'.format(key, ratio(old[key], new[key])))
+    for (a, b) in zip(old['search'], new['search']):
+        print('search d{} ordering={}: nodes {}, speed {}'.format(
+            a['depth'], a['ordering'], ratio(a['nodes'], b['nodes']),
+            ratio(a['nodes_per_second'], b['nodes_per_second'])))
+    for level in old['levels']:
+        if level in new['levels']:
+            print('{}: mean time {}'.format(level, ratio(
+                old['levels'][level]['mean_seconds'],
+                new['levels'][level]['mean_seconds'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark move generation, evaluation and search')
+    parser.add_argument('--backend', default='bitboard',
+                        choices=sorted(reversi.BACKENDS))
+    parser.add_argument('--start-depth', type=int, default=7,
+                        help='perft depth from the start position')
+    parser.add_argument('--corpus-depth', type=int, default=4,
+                        help='perft depth from the corpus positions')
+    parser.add_argument('--search-depth', type=int, default=4)
+    parser.add_argument('--levels', default='easy,medium,hard')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='time spent on each throughput figure')
+    parser.add_argument('--json', help='file to write the results to')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    results = run(args.backend, args.start_depth, args.corpus_depth,
+                  args.search_depth, args.levels.split(','), args.seconds)
+    for result in results['perft']:
+        print('perft {:>6} d{}: {:>9} nodes {:>9.0f} n/s {}'.format(
+            result['name'], result['depth'], result['nodes'],
+            result['nodes_per_second'], 'ok' if result['ok'] else 'WRONG'))
+    print('avl_moves: {:.0f} calls/s'.format(
+        results['avl_moves_per_second']))
+    print('evaluate: {:.0f} calls/s'.format(results['evaluate_per_second']))
+    for result in results['search']:
+        print('search d{} ordering={}: {} nodes {:.0f} n/s'.format(
+            result['depth'], result['ordering'], result['nodes'],
+            result['nodes_per_second']))
+    for (level, result) in results['levels'].items():
+        print('{}: {:.3f}s mean {:.3f}s max'.format(
+            level, result['mean_seconds'], result['max_seconds']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    if not all(result['ok'] for result in results['perft']):
+        sys.exit(1)
@@ -0,0 +1,216 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import json
+import mmap
+import struct
+import reversi
+
+
+# File layout: a header, then one record per (position, move) sorted by
+# position key. Keys are of the position with the player to move's discs
+# first, folded over the 8 symmetries of the board, and moves are squares
+# in that folded orientation. Each record holds the number of games the
+# move was played in and the sum of the final disc margins for the player
+# who played it.
+MAGIC = b'RVBK'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<QBHi')
+
+_REVERSE_BITS = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+
+def _flip_vertical(b):
+    return int.from_bytes(b.to_bytes(8, 'little'), 'big')
+
+
+def _mirror(b):
+    return int.from_bytes(b.to_bytes(8, 'little').translate(_REVERSE_BITS),
+                          'little')
+
+
+def _transpose(b):
+    t = 0x0F0F0F0F00000000 & (b ^ (b << 28))
+    b ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (b ^ (b << 14))
+    b ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (b ^ (b << 7))
+    b ^= t ^ (t >> 7)
+    return b
+
+
+def symmetries(b):
+    # Return the images of a disc mask under the 8 symmetries of the board,
+    # always in the same order
+    images = []
+    for t in (b, _transpose(b)):
+        v = _flip_vertical(t)
+        images += [t, _mirror(t), v, _mirror(v)]
+    return images
+
+
+def _mix(own, other):
+    # Hash the 128 bits of a position down to 64
+    h = (own * 0x9E3779B97F4A7C15 ^ other * 0xC2B2AE3D27D4EB4F) & reversi.FULL
+    h ^= h >> 31
+    h = (h * 0xBF58476D1CE4E5B9) & reversi.FULL
+    return h ^ (h >> 29)
+
+
+def canonical(board, player):
+    # Return (key, symmetry) of a position, where symmetry is the index of
+    # the image of the board the key was taken from
+    (black, white) = board.bitmasks()
+    if player == reversi.BLACK:
+        (own, other) = (black, white)
+    else:
+        (own, other) = (white, black)
+    images = list(zip(symmetries(own), symmetries(other)))
+    s = min(range(8), key=lambda i: images[i])
+    return (_mix(*images[s]), s)
+
+
+def transform(pos, s):
+    # Return the square that `pos` maps to under symmetry `s`
+    (x, y) = pos
+    bit = symmetries(1 << (8 * x + y))[s]
+    sq = bit.bit_length() - 1
+    return (sq >> 3, sq & 7)
+
+
+class OpeningBook:
+    # Read-only opening book, memory-mapped so that opening it costs nothing
+    # whatever its size
+
+    def __init__(self, path, min_games=1):
+        self.min_games = min_games
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.size) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not an opening book: {}'.format(path))
+        self.hits = self.misses = 0
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def record(self, i):
+        return RECORD.unpack_from(self.data, HEADER.size + i * RECORD.size)
+
+    def entries(self, key):
+        # Return the (move, games, margin) records stored for `key`
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = []
+        while lo < self.size:
+            (k, move, games, margin) = self.record(lo)
+            if k != key:
+                break
+            result.append((move, games, margin))
+            lo += 1
+        return result
+
+    def lookup(self, board, player):
+        # Return the book move for `player`, or None if the position is not
+        # in the book
+        (key, s) = canonical(board, player)
+        best = None
+        best_score = None
+        for (move, games, margin) in self.entries(key):
+            if games >= self.min_games:
+                score = margin / games
+                if best is None or score > best_score:
+                    best = (move >> 3, move & 7)
+                    best_score = score
+        if best is not None:
+            for pos in board.avl_moves(player):
+                if transform(pos, s) == best:
+                    self.hits += 1
+                    return pos
+        self.misses += 1
+        return None
+
+
+def build(games, plies=20, base=()):
+    # Return book records (key, move, games, margin) from an iterable of
+    # move strings such as 'f5d6c3...' of finished games, using the first
+    # `plies` moves of each, added to the records `base` of an earlier book
+    stats = {}
+    for (key, move, count, total) in base:
+        stats[(key, move)] = (count, total)
+    for moves in games:
+        board = reversi.BitBoard()
+        player = reversi.BLACK
+        played = []
+        for i in range(0, len(moves), 2):
+            pos = reversi.parse_square(moves[i:i + 2])
+            if not board.is_valid(player, pos):
+                player = reversi.opp(player)
+            if i // 2 < plies:
+                (key, s) = canonical(board, player)
+                (x, y) = transform(pos, s)
+                played.append((key, 8 * x + y, player))
+            board.move(player, pos)
+            player = reversi.opp(player)
+        margin = board.count(reversi.BLACK) - board.count(reversi.WHITE)
+        for (key, move, player) in played:
+            (count, total) = stats.get((key, move), (0, 0))
+            if player == reversi.WHITE:
+                stats[(key, move)] = (count + 1, total - margin)
+            else:
+                stats[(key, move)] = (count + 1, total + margin)
+    # Counts above 0xFFFF are capped, the margins scaled to match so that
+    # the average margin stays right
+    return sorted((key, move, count, total) if count <= 0xFFFF else
+                  (key, move, 0xFFFF, total * 0xFFFF // count)
+                  for ((key, move), (count, total)) in stats.items())
+
+
+def read(path):
+    # Return the records of a book file
+    book = OpeningBook(path)
+    try:
+        return [book.record(i) for i in range(book.size)]
+    finally:
+        book.close()
+
+
+def write(path, records):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        for record in records:
+            f.write(RECORD.pack(*record))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build an opening book from self-play game records')
+    parser.add_argument('games', nargs='+',
+                        help='JSON lines files written by tournament.py')
+    parser.add_argument('-o', '--out', default='res/book.bin')
+    parser.add_argument('--plies', type=int, default=20,
+                        help='number of moves of each game to keep')
+    parser.add_argument('--merge',
+                        help='book to add the games to (may be the output)')
+    args = parser.parse_args()
+
+    def moves():
+        for path in args.games:
+            with open(path) as f:
+                for line in f:
+                    yield json.loads(line)['moves']
+
+    base = read(args.merge) if args.merge else ()
+    records = build(moves(), args.plies, base)
+    write(args.out, records)
+    print('{} book records written to {}'.format(len(records), args.out))
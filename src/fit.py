@@ -0,0 +1,180 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import sys
+import time
+import numpy as np
+import batch
+import records
+import reversi
+
+
+# Squares of every pattern padded to the longest with square 64, which is
+# always empty, and the power of 3 of each square
+_WIDTH = max(len(members) for (shape, members) in reversi.PATTERNS)
+SQUARES = np.array([members + [64] * (_WIDTH - len(members))
+                    for (shape, members) in reversi.PATTERNS])
+POWERS = np.array([[3 ** k for k in range(len(members))] +
+                   [0] * (_WIDTH - len(members))
+                   for (shape, members) in reversi.PATTERNS], dtype=np.int32)
+OFFSETS = np.array([reversi.PATTERN_OFFSETS[shape]
+                    for (shape, members) in reversi.PATTERNS], dtype=np.int32)
+
+# Units of the stored weights, in discs
+SCALE = 1 / 256
+
+
+def features(black, white):
+    # Return reversi.pattern_codes of arrays of positions as an (N, P)
+    # int32 array
+    bits = np.arange(64, dtype=np.uint64)
+    digits = np.zeros((len(black), 65), dtype=np.int32)
+    digits[:, :64] = ((black[:, None] >> bits) & np.uint64(1)) + \
+        2 * ((white[:, None] >> bits) & np.uint64(1))
+    return (digits[:, SQUARES] * POWERS).sum(-1, dtype=np.int32) + OFFSETS
+
+
+def positions(games, chunk=20000):
+    # Yield (black, white, margin) arrays of the positions in an iterable of
+    # game records after each move, `chunk` positions at a time, margin
+    # being the final disc margin for black
+    (black, white, margin) = ([], [], [])
+    for (b, w, result, moves) in games:
+        board = None
+        for (board, player, pos) in records.replay(moves):
+            # The position before each move but the first, then the last
+            if board.count(reversi.BLACK) + board.count(reversi.WHITE) > 4:
+                (bm, wm) = board.bitmasks()
+                black.append(bm)
+                white.append(wm)
+                margin.append(result)
+        if board is not None:
+            (bm, wm) = board.bitmasks()
+            black.append(bm)
+            white.append(wm)
+            margin.append(result)
+        if len(black) >= chunk:
+            yield (np.array(black, dtype=np.uint64),
+                   np.array(white, dtype=np.uint64),
+                   np.array(margin, dtype=np.float32))
+            (black, white, margin) = ([], [], [])
+    if black:
+        yield (np.array(black, dtype=np.uint64),
+               np.array(white, dtype=np.uint64),
+               np.array(margin, dtype=np.float32))
+
+
+def load(games, phases, limit=None):
+    # Return (features, phase, margin) arrays of the positions of game
+    # records, each also with the colours swapped, which fit.py trains on;
+    # positions past `limit` are left out
+    parts = []
+    n = 0
+    for (black, white, margin) in positions(games):
+        discs = batch.popcount(black | white)
+        phase = np.clip((discs - 4) * phases // 61, 0, phases - 1)
+        for (own, other, sign) in ((black, white, 1), (white, black, -1)):
+            parts.append((features(own, other), phase.astype(np.uint8),
+                          sign * margin))
+        n += len(black)
+        if limit is not None and n >= limit:
+            break
+    if not parts:
+        raise ValueError('no positions to fit')
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def solve(x, y, ridge=1.0, iterations=100):
+    # Return the weights w, of size reversi.PATTERN_SIZE, minimising
+    # |A w - y|^2 + ridge |w|^2, where row i of A has a one in each column
+    # x[i] and in the last (the constant). Conjugate gradients on the
+    # normal equations (CGLS), with A applied through indexing and bincount
+    # so that it is never built.
+    size = reversi.PATTERN_SIZE
+    flat = x.ravel()
+    width = x.shape[1]
+
+    def forward(w):
+        return w[x].sum(1) + w[size - 1]
+
+    def backward(r):
+        g = np.bincount(flat, weights=np.repeat(r, width), minlength=size)
+        g[size - 1] += r.sum()
+        return g
+
+    w = np.zeros(size)
+    r = y.astype(np.float64)
+    s = backward(r)
+    p = s.copy()
+    gamma = s @ s
+    for i in range(iterations):
+        q = forward(p)
+        alpha = gamma / (q @ q + ridge * (p @ p))
+        w += alpha * p
+        r -= alpha * q
+        s = backward(r) - ridge * w
+        new_gamma = s @ s
+        if new_gamma < 1e-12:
+            break
+        p = s + new_gamma / gamma * p
+        gamma = new_gamma
+    return w
+
+
+def fit(x, phase, y, phases, ridge=1.0, iterations=100):
+    # Return one array of weights per phase, with the training error of each
+    tables = []
+    errors = []
+    for i in range(phases):
+        rows = phase == i
+        w = solve(x[rows], y[rows], ridge, iterations)
+        residual = w[x[rows]].sum(1) + w[-1] - y[rows]
+        tables.append(w)
+        errors.append(float(np.sqrt((residual ** 2).mean()))
+                      if rows.any() else 0.0)
+    return (tables, errors)
+
+
+def write(path, tables, scale=SCALE):
+    # Write weights in the format reversi.PatternWeights reads
+    with open(path, 'wb') as f:
+        f.write(reversi.PatternWeights.HEADER.pack(
+            reversi.PatternWeights.MAGIC, reversi.PatternWeights.VERSION,
+            len(tables), reversi.PATTERN_SIZE, scale))
+        for w in tables:
+            q = np.clip(np.rint(w / scale), -32768, 32767)
+            f.write(q.astype('<i2').tobytes())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fit pattern evaluation weights to self-play games')
+    parser.add_argument('games', nargs='+',
+                        help='game record files, or JSON lines files '
+                             'written by tournament.py')
+    parser.add_argument('-o', '--out', default=reversi.PATTERN_WEIGHTS)
+    parser.add_argument('--phases', type=int, default=6,
+                        help='number of game phases with their own weights')
+    parser.add_argument('--ridge', type=float, default=1.0,
+                        help='penalty on the size of the weights')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=None,
+                        help='most positions to read')
+    args = parser.parse_args()
+
+    def games():
+        for path in args.games:
+            yield from records.open_records(path)
+
+    start = time.perf_counter()
+    (x, phase, y) = load(games(), args.phases, args.limit)
+    print('{} positions read in {:.1f}s'.format(
+        len(y) // 2, time.perf_counter() - start), file=sys.stderr)
+    start = time.perf_counter()
+    (tables, errors) = fit(x, phase, y, args.phases, args.ridge,
+                           args.iterations)
+    print('fitted in {:.1f}s, rms error by phase: {}'.format(
+        time.perf_counter() - start,
+        ' '.join('{:.1f}'.format(e) for e in errors)), file=sys.stderr)
+    write(args.out, tables)
+    print('weights written to {}'.format(args.out))
@@ -0,0 +1,172 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+
+class Client:
+    # One connection to the server, shared by many sessions; replies are
+    # matched to requests by id
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.task = asyncio.create_task(self.read())
+
+    async def read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply.get('id'), None)
+            # A request whose awaiter was cancelled has a done future
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError('connection closed'))
+        self.waiting.clear()
+
+    async def request(self, **request):
+        key = request['id'] = next(self.ids)
+        future = self.waiting[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.writer.write((json.dumps(request) + '\n').encode())
+            await self.writer.drain()
+            return await future
+        finally:
+            self.waiting.pop(key, None)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.task.cancel()
+
+
+def percentile(values, p):
+    # Return the p-th percentile (0-100) of a non-empty list, nearest rank
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def play(client, algorithm, budget_ms, moves, latencies, errors, rng):
+    # Play one game as a random human and record the latency of each move
+    # Requests refused as busy are retried after a random, growing delay
+    human = rng.choice(('black', 'white'))
+    backoff = 0.05
+    while True:
+        state = await client.request(op='new', human=human,
+                                     algorithm=algorithm, budget_ms=budget_ms)
+        if 'error' not in state:
+            break
+        errors[state['error']] = errors.get(state['error'], 0) + 1
+        if state['error'] != 'busy':
+            return
+        await asyncio.sleep(backoff * rng.random())
+        backoff = min(2 * backoff, 2.0)
+    played = 0
+    backoff = 0.05
+    while not state['over'] and played < moves:
+        square = rng.choice(state['moves'])
+        start = time.perf_counter()
+        reply = await client.request(op='move', session=state['session'],
+                                     square=square, budget_ms=budget_ms)
+        if 'error' in reply:
+            errors[reply['error']] = errors.get(reply['error'], 0) + 1
+            if reply['error'] != 'busy':
+                break
+            await asyncio.sleep(backoff * rng.random())
+            backoff = min(2 * backoff, 2.0)
+            continue
+        backoff = 0.05
+        latencies.append(time.perf_counter() - start)
+        state = reply
+        played += 1
+    await client.request(op='close', session=state['session'])
+
+
+async def run(args):
+    clients = []
+    for i in range(args.connections):
+        if args.unix:
+            (reader, writer) = await asyncio.open_unix_connection(args.unix)
+        else:
+            (reader, writer) = await asyncio.open_connection(args.host,
+                                                             args.port)
+        clients.append(Client(reader, writer))
+
+    rng = random.Random(args.seed)
+    latencies = []
+    errors = {}
+    depths = []
+
+    async def monitor():
+        while True:
+            reply = await clients[0].request(op='stats')
+            depths.append(reply['queue_depth'])
+            await asyncio.sleep(0.1)
+
+    watcher = asyncio.create_task(monitor())
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        play(clients[i % len(clients)], args.algorithm, args.budget,
+             args.moves, latencies, errors, random.Random(rng.random()))
+        for i in range(args.sessions)))
+    seconds = time.perf_counter() - start
+    watcher.cancel()
+    stats = await clients[0].request(op='stats')
+    for client in clients:
+        await client.close()
+
+    result = {
+        'sessions': args.sessions,
+        'moves': len(latencies),
+        'seconds': seconds,
+        'moves_per_second': len(latencies) / seconds,
+        'p50_ms': 1000 * percentile(latencies, 50) if latencies else None,
+        'p99_ms': 1000 * percentile(latencies, 99) if latencies else None,
+        'max_ms': 1000 * max(latencies) if latencies else None,
+        'max_queue_depth': max(depths) if depths else 0,
+        'errors': errors,
+        'server': stats
+    }
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure move latency of a game server under load')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', help='connect to this Unix socket instead')
+    parser.add_argument('-n', '--sessions', type=int, default=100,
+                        help='games played at once')
+    parser.add_argument('-c', '--connections', type=int, default=10)
+    parser.add_argument('--algorithm', default='medium')
+    parser.add_argument('--budget', type=int, default=None,
+                        help='thinking time per move in ms')
+    parser.add_argument('--moves', type=int, default=10,
+                        help='human moves per game')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print('{} moves in {:.1f}s ({:.1f} moves/s)'.format(
+        result['moves'], result['seconds'], result['moves_per_second']))
+    if result['moves']:
+        print('latency p50 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms'.format(
+            result['p50_ms'], result['p99_ms'], result['max_ms']))
+    print('max queue depth {}'.format(result['max_queue_depth']))
+    if result['errors']:
+        print('errors: {}'.format(result['errors']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
@@ -1,64 +1,156 @@
 # Author: Ayan Banerjee <ayanb280@gmail.com>
 
-from copy import deepcopy
+import time
+
+# Start of the program, for the startup timing report
+START = time.perf_counter()
+
+import os
 import sys
 import threading
 import pygame
+import book
 import reversi
 
+IMPORTED = time.perf_counter()
+
 
 TO_WORDS = {
     reversi.BLACK: 'Black',
     reversi.WHITE: 'White'
 }
 
+# Posted by the computer's thread when it has played its move
+ENGINE_DONE = pygame.USEREVENT + 1
+
+# Milliseconds between redraws while the computer is thinking, to keep its
+# search speed on screen up to date
+THINKING_REFRESH = 250
+
+# Time from the start of the program to the first frame on screen we aim
+# for, in milliseconds
+FIRST_FRAME_TARGET = 500
+
+# Images, sounds and fonts, loaded by App on first use
+ASSETS = {
+    'ONE_IMG': ('image', 'res/img/one.png'),
+    'TWO_IMG': ('image', 'res/img/two.png'),
+    'EASY_IMG': ('image', 'res/img/1-star.png'),
+    'MEDIUM_IMG': ('image', 'res/img/2-star.png'),
+    'HARD_IMG': ('image', 'res/img/3-star.png'),
+    'BLACK_IMG': ('image', 'res/img/black.png'),
+    'WHITE_IMG': ('image', 'res/img/white.png'),
+    'BLACK_IMG_SMALL': ('image', 'res/img/black-small.png'),
+    'WHITE_IMG_SMALL': ('image', 'res/img/white-small.png'),
+    'MOVE_SOUND': ('sound', 'res/sound/move.wav'),
+    'FONT_NORMAL': ('font', 'res/font/Nunito-Regular.ttf', 22),
+    'FONT_BIG': ('font', 'res/font/Nunito-ExtraBold.ttf', 35),
+    'FONT_HUGE': ('font', 'res/font/Nunito-Black.ttf', 70),
+    # Opening book, built with book.py from self-play games
+    'BOOK': ('book', 'res/book.bin')
+}
+
 
 class App:
-    def __init__(self):
-        # Initialize variables, load images, sounds, fonts.
-        pygame.init()
+    def __init__(self, convert=True, timing=False):
+        # Initialize variables and open the window. Only the display and
+        # font modules are started here, and images, sounds and fonts are
+        # loaded when first used (see ASSETS). With `convert`, images are
+        # converted to the display's pixel format as they load, which makes
+        # blitting them faster. With `timing`, a startup timing report is
+        # printed once the first frame is up.
+        pygame.display.init()
         pygame.font.init()
+        self.convert = convert
+        self.timing = timing
+        self.TIMINGS = [('imports', IMPORTED)]
+        self.ASSET_LOCK = threading.Lock()
+        self.ASSET_TIME = 0.0
+        self.ASSET_COUNT = 0
 
         self.BGCOLOR = (11, 118, 48)
         self.FGCOLOR = (55, 200, 100)
         self.WINDOWCOLOR = (180, 200, 220)
 
-        self.ONE_IMG = pygame.image.load('res/img/one.png')
-        self.TWO_IMG = pygame.image.load('res/img/two.png')
-
-        self.EASY_IMG = pygame.image.load('res/img/1-star.png')
-        self.MEDIUM_IMG = pygame.image.load('res/img/2-star.png')
-        self.HARD_IMG = pygame.image.load('res/img/3-star.png')
-
-        self.BLACK_IMG = pygame.image.load('res/img/black.png')
-        self.WHITE_IMG = pygame.image.load('res/img/white.png')
-        self.BLACK_IMG_SMALL = pygame.image.load('res/img/black-small.png')
-        self.WHITE_IMG_SMALL = pygame.image.load('res/img/white-small.png')
-
-        self.MOVE_SOUND = pygame.mixer.Sound('res/sound/move.wav')
-
         self.BLACK_COL = (0, 0, 0)
         self.WHITE_COL = (255, 255, 255)
 
-        self.FONT_NORMAL = pygame.font.Font('res/font/Nunito-Regular.ttf', 22)
-        self.FONT_BIG = pygame.font.Font('res/font/Nunito-ExtraBold.ttf', 35)
-        self.FONT_HUGE = pygame.font.Font('res/font/Nunito-Black.ttf', 70)
-
         self.SCREENWIDTH = 640
         self.SCREENHEIGHT = 480
 
         self.MOUSEX = 0
         self.MOUSEY = 0
 
-        self.FPS = 50
         self.ABORTED = False
+        # Move log lengths to go back to on undo
         self.UNDO_STACK = []
 
         self.WINDOW = pygame.display.set_mode(
             (self.SCREENWIDTH, self.SCREENHEIGHT))
-        self.CLOCK = pygame.time.Clock()
         pygame.display.set_caption('Reversi')
+        self.TIMINGS.append(('display', time.perf_counter()))
         self.human = self.computer = None
+        self.game = None
+        self.TEXT_CACHE = {}
+        # draw() runs on both the main and the computer's thread
+        self.DRAW_LOCK = threading.Lock()
+        # Surfaces of the game screen, made by build_surfaces when first
+        # needed
+        self.BACKGROUND = None
+        self.drawn = {}
+        self.ponder_thread = None
+        self.ponder_stop = threading.Event()
+        self.comp_thread = None
+        self.comp_stop = threading.Event()
+        # Square of the computer's move, shown before its discs are flipped
+        self.preview = None
+
+    def __getattr__(self, name):
+        # Load an asset on first use and keep it as an attribute
+        if name not in ASSETS:
+            raise AttributeError(name)
+        with self.ASSET_LOCK:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            start = time.perf_counter()
+            (kind, path, *args) = ASSETS[name]
+            if kind == 'image':
+                asset = pygame.image.load(path)
+                if self.convert:
+                    asset = asset.convert_alpha()
+            elif kind == 'sound':
+                if not pygame.mixer.get_init():
+                    pygame.mixer.init()
+                asset = pygame.mixer.Sound(path)
+            elif kind == 'font':
+                asset = pygame.font.Font(path, *args)
+            elif os.path.exists(path):
+                asset = book.OpeningBook(path)
+            else:
+                asset = None
+            self.ASSET_TIME += time.perf_counter() - start
+            self.ASSET_COUNT += 1
+            setattr(self, name, asset)
+            return asset
+
+    def first_frame(self):
+        # Note that a frame is on screen; the first time, print the startup
+        # timing report if asked to
+        if self.TIMINGS[-1][0] == 'first frame':
+            return
+        self.TIMINGS.append(('first frame', time.perf_counter()))
+        if not self.timing:
+            return
+        for (label, at) in self.TIMINGS:
+            print('{:<12} {:7.1f} ms'.format(label, (at - START) * 1000),
+                  file=sys.stderr)
+        print('{} assets loaded in {:.1f} ms'.format(
+            self.ASSET_COUNT, self.ASSET_TIME * 1000), file=sys.stderr)
+        total = (self.TIMINGS[-1][1] - START) * 1000
+        print('time to first frame {:.0f} ms (target {} ms): {}'.format(
+            total, FIRST_FRAME_TARGET,
+            'ok' if total <= FIRST_FRAME_TARGET else 'too slow'),
+            file=sys.stderr)
 
     def run(self):
         # Run the program
@@ -67,8 +159,14 @@ class App:
             if self.gamemode == 'singleplayer':
                 self.select_player()
                 self.select_algorithm()
+                # Pattern evaluation once weights have been fitted (see
+                # fit.py)
+                backend = 'bitboard'
+                if os.path.exists(reversi.PATTERN_WEIGHTS):
+                    backend = 'pattern'
                 self.game = reversi.Game(
-                    human=self.human, algorithm=self.algorithm)
+                    human=self.human, algorithm=self.algorithm,
+                    backend=backend, collect_stats=True, book=self.BOOK)
                 self.play_single()
             else:
                 self.game = reversi.Game()
@@ -77,30 +175,35 @@ class App:
                 self.display_winner()
             else:
                 self.ABORTED = False
+            self.game.close()
 
     def quit(self):
         # Exit
+        self.stop_computer()
+        self.stop_pondering()
+        if self.game is not None:
+            self.game.close()
         pygame.quit()
         sys.exit()
 
+    def events(self, timeout=None):
+        # Sleep until there is an event, or for at most `timeout`
+        # milliseconds (0: don't sleep), and return all pending events
+        if timeout is None:
+            events = [pygame.event.wait()]
+        elif timeout > 0:
+            events = [pygame.event.wait(timeout)]
+        else:
+            events = []
+        events += pygame.event.get()
+        return [event for event in events if event.type != pygame.NOEVENT]
+
     def select_mode(self):
         # Display screen to select singleplayer/multiplayer game
         msg = self.FONT_BIG.render('Select Game Mode', True, self.BLACK_COL)
         choice1 = self.FONT_NORMAL.render('One Player', True, self.BLACK_COL)
         choice2 = self.FONT_NORMAL.render('Two Player', True, self.BLACK_COL)
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.quit()
-                elif event.type == pygame.MOUSEMOTION:
-                    self.MOUSEX, self.MOUSEY = event.pos
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    if 170 < self.MOUSEX < 290 and 220 < self.MOUSEY < 360:
-                        self.gamemode = 'singleplayer'
-                        return
-                    if 350 < self.MOUSEX < 470 and 220 < self.MOUSEY < 360:
-                        self.gamemode = 'multiplayer'
-                        return
             self.WINDOW.fill(self.BGCOLOR)
             if 170 < self.MOUSEX < 290 and 220 < self.MOUSEY < 360:
                 pygame.draw.rect(self.WINDOW, self.FGCOLOR,
@@ -119,28 +222,27 @@ class App:
                 choice2, (410 - choice2.get_rect().width / 2, 310))
 
             pygame.display.update()
-            self.CLOCK.tick(self.FPS)
+            self.first_frame()
 
-    def select_player(self):
-        # Display screen to select player color
-        msg = self.FONT_BIG.render('Select Color', True, self.BLACK_COL)
-        choice1 = self.FONT_NORMAL.render('Black', True, self.BLACK_COL)
-        choice2 = self.FONT_NORMAL.render('White', True, self.BLACK_COL)
-        while True:
-            for event in pygame.event.get():
+            for event in self.events():
                 if event.type == pygame.QUIT:
                     self.quit()
                 elif event.type == pygame.MOUSEMOTION:
                     self.MOUSEX, self.MOUSEY = event.pos
                 elif event.type == pygame.MOUSEBUTTONUP:
                     if 170 < self.MOUSEX < 290 and 220 < self.MOUSEY < 360:
-                        self.human = reversi.BLACK
-                        self.computer = reversi.WHITE
+                        self.gamemode = 'singleplayer'
                         return
                     if 350 < self.MOUSEX < 470 and 220 < self.MOUSEY < 360:
-                        self.human = reversi.WHITE
-                        self.computer = reversi.BLACK
+                        self.gamemode = 'multiplayer'
                         return
+
+    def select_player(self):
+        # Display screen to select player color
+        msg = self.FONT_BIG.render('Select Color', True, self.BLACK_COL)
+        choice1 = self.FONT_NORMAL.render('Black', True, self.BLACK_COL)
+        choice2 = self.FONT_NORMAL.render('White', True, self.BLACK_COL)
+        while True:
             self.WINDOW.fill(self.BGCOLOR)
             if 170 < self.MOUSEX < 290 and 220 < self.MOUSEY < 360:
                 pygame.draw.rect(self.WINDOW, self.FGCOLOR,
@@ -159,7 +261,21 @@ class App:
                 choice2, (410 - choice2.get_rect().width / 2, 310))
 
             pygame.display.update()
-            self.CLOCK.tick(self.FPS)
+
+            for event in self.events():
+                if event.type == pygame.QUIT:
+                    self.quit()
+                elif event.type == pygame.MOUSEMOTION:
+                    self.MOUSEX, self.MOUSEY = event.pos
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    if 170 < self.MOUSEX < 290 and 220 < self.MOUSEY < 360:
+                        self.human = reversi.BLACK
+                        self.computer = reversi.WHITE
+                        return
+                    if 350 < self.MOUSEX < 470 and 220 < self.MOUSEY < 360:
+                        self.human = reversi.WHITE
+                        self.computer = reversi.BLACK
+                        return
 
     def select_algorithm(self):
         # Display screen to select difficulty level: Easy, Medium or Hard
@@ -169,21 +285,6 @@ class App:
         choice2 = self.FONT_NORMAL.render('Medium', True, self.BLACK_COL)
         choice3 = self.FONT_NORMAL.render('Hard', True, self.BLACK_COL)
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.quit()
-                elif event.type == pygame.MOUSEMOTION:
-                    self.MOUSEX, self.MOUSEY = event.pos
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    if 100 < self.MOUSEX < 220 and 220 < self.MOUSEY < 360:
-                        self.algorithm = 'easy'
-                        return
-                    if 260 < self.MOUSEX < 380 and 220 < self.MOUSEY < 360:
-                        self.algorithm = 'medium'
-                        return
-                    if 420 < self.MOUSEX < 540 and 220 < self.MOUSEY < 360:
-                        self.algorithm = 'hard'
-                        return
             self.WINDOW.fill(self.BGCOLOR)
             if 100 < self.MOUSEX < 220 and 220 < self.MOUSEY < 360:
                 pygame.draw.rect(self.WINDOW, self.FGCOLOR,
@@ -208,38 +309,99 @@ class App:
                 choice3, (480 - choice3.get_rect().width / 2, 310))
 
             pygame.display.update()
-            self.CLOCK.tick(self.FPS)
+
+            for event in self.events():
+                if event.type == pygame.QUIT:
+                    self.quit()
+                elif event.type == pygame.MOUSEMOTION:
+                    self.MOUSEX, self.MOUSEY = event.pos
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    if 100 < self.MOUSEX < 220 and 220 < self.MOUSEY < 360:
+                        self.algorithm = 'easy'
+                        return
+                    if 260 < self.MOUSEX < 380 and 220 < self.MOUSEY < 360:
+                        self.algorithm = 'medium'
+                        return
+                    if 420 < self.MOUSEX < 540 and 220 < self.MOUSEY < 360:
+                        self.algorithm = 'hard'
+                        return
+
+    def start_pondering(self):
+        # Think about the computer's replies while the human is to move
+        if self.game.player == self.human and self.moves:
+            self.ponder_stop = threading.Event()
+            self.ponder_thread = threading.Thread(
+                target=self.game.ponder, args=(self.ponder_stop,),
+                daemon=True)
+            self.ponder_thread.start()
+
+    def stop_pondering(self):
+        # Stop pondering before anything changes the game
+        if self.ponder_thread is not None:
+            self.ponder_stop.set()
+            self.ponder_thread.join()
+            self.ponder_thread = None
+
+    def stop_computer(self):
+        # Cancel the computer's search and wait for its thread to finish
+        if self.comp_thread is not None:
+            self.comp_stop.set()
+            self.comp_thread.join()
+            self.comp_thread = None
+        self.computer_thinking = False
+
+    def undo(self, ply):
+        # Take back moves until the game is back at `ply`
+        while self.game.ply > ply:
+            self.game.undo()
 
     def play_single(self):
         # Play a singleplayer (human-computer) game
         self.UNDO_STACK = []
+        self.drawn = {}
         self.computer_thinking = False
         self.moves = self.game.avl_moves()
+        self.start_pondering()
         self.draw()
         pygame.time.wait(500)
         while True:
-            for event in pygame.event.get():
+            if self.moves == [] or (self.game.player == self.computer and
+                                    not self.computer_thinking):
+                timeout = 0
+            elif self.computer_thinking and self.game.stats is not None:
+                timeout = THINKING_REFRESH
+            else:
+                timeout = None
+            for event in self.events(timeout):
                 if event.type == pygame.QUIT:
                     self.quit()
                 elif event.type == pygame.MOUSEMOTION:
                     self.MOUSEX, self.MOUSEY = event.pos
-                elif not self.computer_thinking and event.type == pygame.MOUSEBUTTONUP:
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    # End Game and Undo cancel the computer's search
                     if 432 < self.MOUSEX < 630 and 382 < self.MOUSEY < 420:
+                        self.stop_computer()
+                        self.stop_pondering()
                         self.ABORTED = True
                         return
                     elif 432 < self.MOUSEX < 630 and 332 < self.MOUSEY < 370:
                         if self.UNDO_STACK:
+                            self.stop_computer()
+                            self.stop_pondering()
                             self.MOVE_SOUND.play()
-                            self.game = self.UNDO_STACK.pop()
+                            self.undo(self.UNDO_STACK.pop())
                             self.moves = self.game.avl_moves()
+                            self.start_pondering()
                             self.draw()
                             break
-                    elif self.game.player == self.human:
+                    elif not self.computer_thinking and \
+                            self.game.player == self.human:
                         self.MOUSEX, self.MOUSEY = event.pos
                         pos = ((self.MOUSEY - 20) // 50,
                                (self.MOUSEX - 20) // 50)
                         if pos in self.moves:
-                            self.UNDO_STACK.append(deepcopy(self.game))
+                            self.stop_pondering()
+                            self.UNDO_STACK.append(self.game.ply)
                             self.MOVE_SOUND.play()
                             self.game.move(pos)
                             self.game.switch_turn()
@@ -254,38 +416,53 @@ class App:
                     pygame.time.wait(1500)
                     self.game.switch_turn()
                     self.moves = self.game.avl_moves()
+                    self.start_pondering()
             elif self.game.player == self.computer:
                 # Generate computer move on a different thread so as not to
                 # block the GUI
                 if not self.computer_thinking:
                     self.computer_thinking = True
-                    comp_thread = threading.Thread(
-                        target=self.play_computer_move)
-                    comp_thread.start()
+                    self.comp_stop = threading.Event()
+                    self.comp_thread = threading.Thread(
+                        target=self.play_computer_move,
+                        args=(self.comp_stop,), daemon=True)
+                    self.comp_thread.start()
             self.draw()
-            self.CLOCK.tick(self.FPS)
         self.winner = self.game.winner()
 
-    def play_computer_move(self):
-        # Generate and play a computer move
-        pygame.time.wait(500)
-        pos = self.game.get_move()
+    def play_computer_move(self, stop):
+        # Generate and play a computer move, unless `stop` is set first
+        if stop.wait(0.5):
+            return
+        pos = self.game.get_move(stop)
+        if pos is None:
+            return
         self.MOVE_SOUND.play()
-        self.game.board.set(self.computer, pos)
+        self.preview = pos
         self.draw()
-        pygame.time.wait(500)
+        stopped = stop.wait(0.5)
+        self.preview = None
+        if stopped:
+            return
         self.game.move(pos)
         self.game.switch_turn()
         self.moves = self.game.avl_moves()
+        # The thread is joined before pondering is stopped, so pondering
+        # started here is stopped too; but don't start it for nothing
+        if not stop.is_set():
+            self.start_pondering()
         self.draw()
         self.computer_thinking = False
+        pygame.event.post(pygame.event.Event(ENGINE_DONE))
 
     def play_multi(self):
         # Play a multiplayer (human-human) game
         self.UNDO_STACK = []
+        self.drawn = {}
         self.moves = self.game.avl_moves()
+        self.draw()
         while not self.game.is_over():
-            for event in pygame.event.get():
+            for event in self.events():
                 if event.type == pygame.QUIT:
                     self.quit()
                 elif event.type == pygame.MOUSEMOTION:
@@ -298,7 +475,7 @@ class App:
                     elif 432 < self.MOUSEX < 630 and 332 < self.MOUSEY < 370:
                         if self.UNDO_STACK != []:
                             self.MOVE_SOUND.play()
-                            self.game = self.UNDO_STACK.pop()
+                            self.undo(self.UNDO_STACK.pop())
                             self.moves = self.game.avl_moves()
                             self.draw()
                             break
@@ -306,7 +483,7 @@ class App:
                         pos = ((self.MOUSEY - 20) // 50,
                                (self.MOUSEX - 20) // 50)
                         if pos in self.moves:
-                            self.UNDO_STACK.append(deepcopy(self.game))
+                            self.UNDO_STACK.append(self.game.ply)
                             self.MOVE_SOUND.play()
                             self.game.move(pos)
                             self.game.switch_turn()
@@ -318,58 +495,64 @@ class App:
                 self.game.switch_turn()
                 self.moves = self.game.avl_moves()
             self.draw()
-            self.CLOCK.tick(self.FPS)
         self.winner = self.game.winner()
 
-    def draw(self):
-        # Draw the game GUI
-        self.WINDOW.fill(self.WINDOWCOLOR)
-        pygame.draw.rect(self.WINDOW, self.BGCOLOR, (19, 19, 402, 402), 0)
-        pygame.draw.rect(self.WINDOW, self.BLACK_COL, (19, 19, 402, 402), 1)
-        if 432 < self.MOUSEX < 630 and 382 < self.MOUSEY < 420:
-            pygame.draw.rect(self.WINDOW, (255, 50, 50),
-                             (432, 382, 198, 38), 0)
-        else:
-            pygame.draw.rect(self.WINDOW, (220, 0, 0), (432, 382, 198, 38), 0)
-        pygame.draw.rect(self.WINDOW, self.BLACK_COL, (432, 382, 198, 38), 2)
-        endgame_msg = self.FONT_NORMAL.render(
-            'End Game', True, (255, 255, 255))
-        if 432 < self.MOUSEX < 630 and 332 < self.MOUSEY < 370:
-            pygame.draw.rect(self.WINDOW, (255, 50, 50),
-                             (432, 332, 198, 38), 0)
-        else:
-            pygame.draw.rect(self.WINDOW, (220, 0, 0), (432, 332, 198, 38), 0)
-        pygame.draw.rect(self.WINDOW, self.BLACK_COL, (432, 332, 198, 38), 2)
-        undo_msg = self.FONT_NORMAL.render('Undo', True, (255, 255, 255))
+    def build_surfaces(self):
+        # Draw the parts of the game screen that never change, and both
+        # looks of each button, once
+        self.BACKGROUND = pygame.Surface(
+            (self.SCREENWIDTH, self.SCREENHEIGHT)).convert()
+        self.BACKGROUND.fill(self.WINDOWCOLOR)
+        pygame.draw.rect(self.BACKGROUND, self.BGCOLOR, (19, 19, 402, 402), 0)
+        pygame.draw.rect(self.BACKGROUND, self.BLACK_COL,
+                         (19, 19, 402, 402), 1)
         for i in range(8):
             for j in range(8):
-                pygame.draw.rect(self.WINDOW, self.BLACK_COL,
+                pygame.draw.rect(self.BACKGROUND, self.BLACK_COL,
                                  (50 * j + 20, 50 * i + 20, 50, 50), 1)
-                if self.gamemode == 'multiplayer' or self.game.player == self.human:
-                    if (i, j) in self.moves:
-                        pygame.draw.circle(
-                            self.WINDOW, self.FGCOLOR, (50 * j + 45, 50 * i + 45), 4)
-                if 50 * j + 20 < self.MOUSEX < 50 * j + \
-                        70 and 50 * i + 20 < self.MOUSEY < 50 * i + 70:
-                    pygame.draw.rect(self.WINDOW, self.FGCOLOR,
-                                     (50 * j + 21, 50 * i + 21, 48, 48))
-                if self.game.board.get((i, j)) == reversi.BLACK:
-                    self.WINDOW.blit(
-                        self.BLACK_IMG, (50 * j + 25, 50 * i + 25))
-                elif self.game.board.get((i, j)) == reversi.WHITE:
-                    self.WINDOW.blit(
-                        self.WHITE_IMG, (50 * j + 25, 50 * i + 25))
-
-        blk = self.FONT_NORMAL.render(
-            ' = ' + str(self.game.score(reversi.BLACK)), True, (0, 0, 0))
-        wht = self.FONT_NORMAL.render(
-            ' = ' + str(self.game.score(reversi.WHITE)), True, (0, 0, 0))
-        ptr = self.FONT_NORMAL.render('*', True, (255, 0, 0))
-
-        self.WINDOW.blit(self.BLACK_IMG_SMALL, (480, 30))
-        self.WINDOW.blit(self.WHITE_IMG_SMALL, (480, 70))
-        self.WINDOW.blit(blk, (505, 30))
-        self.WINDOW.blit(wht, (505, 70))
+        self.BACKGROUND.blit(self.BLACK_IMG_SMALL, (480, 30))
+        self.BACKGROUND.blit(self.WHITE_IMG_SMALL, (480, 70))
+        self.POINTER = self.FONT_NORMAL.render('*', True, (255, 0, 0))
+
+        self.BUTTONS = {}
+        for label in ('End Game', 'Undo'):
+            text = self.FONT_NORMAL.render(label, True, (255, 255, 255))
+            for (hover, colour) in ((False, (220, 0, 0)),
+                                    (True, (255, 50, 50))):
+                button = pygame.Surface((198, 38)).convert()
+                button.fill(colour)
+                pygame.draw.rect(button, self.BLACK_COL, (0, 0, 198, 38), 2)
+                button.blit(text, (99 - text.get_rect().width / 2,
+                                   19 - text.get_rect().height / 2))
+                self.BUTTONS[(label, hover)] = button
+
+        # Screen regions that draw() repaints on their own, and what was
+        # last drawn in each
+        line = self.FONT_NORMAL.get_height()
+        self.SCORE_RECTS = {
+            reversi.BLACK: (505, 30, 135, line),
+            reversi.WHITE: (505, 70, 135, line)
+        }
+        self.BUTTON_RECTS = {
+            'End Game': (432, 382, 198, 38),
+            'Undo': (432, 332, 198, 38)
+        }
+        self.POINTER_RECT = (460, 30, 15, 40 + line)
+        self.STATUS_RECT = (0, 425, 640, 55)
+        self.drawn = {}
+
+    def text(self, msg):
+        # Render `msg` in the normal font, reusing earlier renderings
+        surface = self.TEXT_CACHE.get(msg)
+        if surface is None:
+            if len(self.TEXT_CACHE) > 256:
+                self.TEXT_CACHE.clear()
+            surface = self.TEXT_CACHE[msg] = self.FONT_NORMAL.render(
+                msg, True, (0, 0, 0))
+        return surface
+
+    def status(self):
+        # Return the message shown under the board
         if self.game.is_over():
             msg = 'Game over'
         elif self.moves == []:
@@ -379,23 +562,91 @@ class App:
             msg = TO_WORDS[self.game.player] + '\'s turn'
         elif self.game.player == self.human:
             msg = 'Your turn'
-        elif self.game.player == self.computer:
+        else:
             msg = 'Computer is thinking'
-
-        if self.game.player == reversi.BLACK:
-            self.WINDOW.blit(ptr, (460, 30))
+            stats = self.game.stats
+            if self.computer_thinking and stats is not None and stats.nodes:
+                msg += ' ({:.0f}k nodes/s)'.format(
+                    stats.nodes_per_second() / 1000)
+        return msg
+
+    def layout(self):
+        # Return (rect, state) for each region of the game screen, where
+        # state is everything that decides how the region looks
+        show_moves = self.gamemode == 'multiplayer' or \
+            self.game.player == self.human
+        regions = []
+        for i in range(8):
+            for j in range(8):
+                rect = (50 * j + 20, 50 * i + 20, 50, 50)
+                hover = 50 * j + 20 < self.MOUSEX < 50 * j + 70 and \
+                    50 * i + 20 < self.MOUSEY < 50 * i + 70
+                disc = self.game.board.get((i, j))
+                if (i, j) == self.preview:
+                    disc = self.computer
+                regions.append((rect, (
+                    disc,
+                    show_moves and (i, j) in self.moves,
+                    hover)))
+        for (label, rect) in self.BUTTON_RECTS.items():
+            (x, y, w, h) = rect
+            hover = x < self.MOUSEX < x + w and y < self.MOUSEY < y + h
+            regions.append((rect, (label, hover)))
+        for (player, rect) in self.SCORE_RECTS.items():
+            regions.append((rect, ' = ' + str(self.game.score(player))))
+        regions.append((self.POINTER_RECT, self.game.player))
+        regions.append((self.STATUS_RECT, self.status()))
+        return regions
+
+    def paint(self, rect, state):
+        # Draw one region of the game screen over its background
+        (x, y, w, h) = rect
+        if rect == self.POINTER_RECT:
+            if state == reversi.BLACK:
+                self.WINDOW.blit(self.POINTER, (460, 30))
+            else:
+                self.WINDOW.blit(self.POINTER, (460, 70))
+        elif rect == self.STATUS_RECT:
+            msg = self.text(state)
+            self.WINDOW.blit(msg, (20, 450 - msg.get_rect().height / 2))
+        elif rect in self.SCORE_RECTS.values():
+            self.WINDOW.blit(self.text(state), (x, y))
+        elif rect in self.BUTTON_RECTS.values():
+            self.WINDOW.blit(self.BUTTONS[state], (x, y))
         else:
-            self.WINDOW.blit(ptr, (460, 70))
-
-        msg = self.FONT_NORMAL.render(msg, True, (0, 0, 0))
-        self.WINDOW.blit(msg, (20, 450 - msg.get_rect().height / 2))
-        self.WINDOW.blit(
-            endgame_msg,
-            (531 - endgame_msg.get_rect().width / 2,
-             401 - endgame_msg.get_rect().height / 2))
-        self.WINDOW.blit(undo_msg, (531 - undo_msg.get_rect().width /
-                                    2, 351 - undo_msg.get_rect().height / 2))
-        pygame.display.update()
+            (disc, hint, hover) = state
+            if hint:
+                pygame.draw.circle(self.WINDOW, self.FGCOLOR,
+                                   (x + 25, y + 25), 4)
+            if hover:
+                pygame.draw.rect(self.WINDOW, self.FGCOLOR,
+                                 (x + 1, y + 1, 48, 48))
+            if disc == reversi.BLACK:
+                self.WINDOW.blit(self.BLACK_IMG, (x + 5, y + 5))
+            elif disc == reversi.WHITE:
+                self.WINDOW.blit(self.WHITE_IMG, (x + 5, y + 5))
+
+    def draw(self):
+        # Draw the game GUI. Only the regions whose state changed since the
+        # last call are repainted and sent to the display; after another
+        # screen was shown (self.drawn emptied) everything is.
+        with self.DRAW_LOCK:
+            if self.BACKGROUND is None:
+                self.build_surfaces()
+            full = not self.drawn
+            if full:
+                self.WINDOW.blit(self.BACKGROUND, (0, 0))
+            dirty = []
+            for (rect, state) in self.layout():
+                if full or self.drawn.get(rect) != state:
+                    self.drawn[rect] = state
+                    self.WINDOW.blit(self.BACKGROUND, rect, rect)
+                    self.paint(rect, state)
+                    dirty.append(rect)
+            if full:
+                pygame.display.update()
+            elif dirty:
+                pygame.display.update(dirty)
 
     def display_winner(self):
         # Display the color of the winning player
@@ -413,15 +664,14 @@ class App:
                                2, 240 - msg.get_rect().height / 2))
         pygame.display.update()
         while True:
-            for event in pygame.event.get():
+            for event in self.events():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
                 if event.type == pygame.MOUSEBUTTONUP:
                     return
-            self.CLOCK.tick(self.FPS)
 
 
 if __name__ == '__main__':
-    app = App()
+    app = App(convert='--no-convert' not in sys.argv,
+              timing='--timing' in sys.argv)
     app.run()
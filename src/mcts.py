@@ -0,0 +1,336 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from reversi import BLACK, legal_moves, flips
+
+# Move of a node reached by passing
+PASS = 64
+
+# Exploration constant of UCT
+EXPLORATION = 1.4
+
+# Number of playouts between two checks of the clock
+CHECK_EVERY = 16
+
+
+def random_square(moves, rng):
+    # Return a random square of the bitmask `moves`
+    for i in range(rng.randrange(moves.bit_count())):
+        moves &= moves - 1
+    return (moves & -moves).bit_length() - 1
+
+
+def playout(own, other, rng):
+    # Play random moves from a position with the owner of `own` to move
+    # until the game ends, and return the final disc margin for that player
+    sign = 1
+    passed = False
+    while True:
+        moves = legal_moves(own, other)
+        if moves:
+            sq = random_square(moves, rng)
+            f = flips(own, other, sq)
+            (own, other) = (other & ~f, own | f | (1 << sq))
+            passed = False
+        elif passed:
+            break
+        else:
+            (own, other) = (other, own)
+            passed = True
+        sign = -sign
+    return sign * (own.bit_count() - other.bit_count())
+
+
+def play(own, other, move):
+    # Return the position after `move` (a square or PASS), from the view of
+    # the player to move next
+    if move == PASS:
+        return (other, own)
+    f = flips(own, other, move)
+    return (other & ~f, own | f | (1 << move))
+
+
+class Tree:
+    # Search tree kept in parallel arrays indexed by node, node 0 being the
+    # root. The children of a node are allocated together, so a node only
+    # records the first of them and how many there are; `first` is 0 for a
+    # node not yet expanded and -1 for the end of the game. `wins` counts
+    # playouts won (a draw as half) by the player who made the node's move.
+
+    def __init__(self, own, other):
+        self.own = own
+        self.other = other
+        self.move = array('B', [PASS])
+        self.first = array('i', [0])
+        self.count = array('B', [0])
+        self.visits = array('I', [0])
+        self.wins = array('d', [0.0])
+
+    def __len__(self):
+        return len(self.move)
+
+    def add(self, move, visits=0, wins=0.0):
+        self.move.append(move)
+        self.first.append(0)
+        self.count.append(0)
+        self.visits.append(visits)
+        self.wins.append(wins)
+
+    def expand(self, node, own, other):
+        moves = legal_moves(own, other)
+        if not moves and not legal_moves(other, own):
+            self.first[node] = -1
+            return
+        self.first[node] = len(self.move)
+        if not moves:
+            self.add(PASS)
+            self.count[node] = 1
+            return
+        n = 0
+        while moves:
+            sq = (moves & -moves).bit_length() - 1
+            moves &= moves - 1
+            self.add(sq)
+            n += 1
+        self.count[node] = n
+
+    def select(self, node):
+        # Return the child of `node` to descend to: an unvisited one if
+        # there is one, else the one with the highest UCT value
+        visits = self.visits
+        wins = self.wins
+        first = self.first[node]
+        log_n = math.log(visits[node])
+        best = None
+        best_value = -1.0
+        for child in range(first, first + self.count[node]):
+            n = visits[child]
+            if not n:
+                return child
+            value = wins[child] / n + EXPLORATION * math.sqrt(log_n / n)
+            if value > best_value:
+                best = child
+                best_value = value
+        return best
+
+    def iterate(self, rng):
+        # Run one selection, expansion, playout and backup
+        node = 0
+        (own, other) = (self.own, self.other)
+        path = [0]
+        while self.first[node] > 0:
+            node = self.select(node)
+            (own, other) = play(own, other, self.move[node])
+            path.append(node)
+        if self.first[node] == 0:
+            self.expand(node, own, other)
+            if self.first[node] > 0:
+                node = self.first[node]
+                (own, other) = play(own, other, self.move[node])
+                path.append(node)
+        margin = playout(own, other, rng)
+        # The margin is for the player to move at the leaf; the leaf's
+        # move was made by the other player
+        if margin < 0:
+            result = 1.0
+        elif margin > 0:
+            result = 0.0
+        else:
+            result = 0.5
+        for node in reversed(path):
+            self.visits[node] += 1
+            self.wins[node] += result
+            result = 1.0 - result
+
+    def root_stats(self):
+        # Return (move, visits, wins) of each child of the root
+        first = self.first[0]
+        if first <= 0:
+            return []
+        return [(self.move[c], self.visits[c], self.wins[c])
+                for c in range(first, first + self.count[0])]
+
+    def find(self, own, other, depth=2):
+        # Return the node at most `depth` plies below the root whose
+        # position is own/other, or None
+        level = [(0, self.own, self.other)]
+        for i in range(depth + 1):
+            following = []
+            for (node, o, t) in level:
+                if (o, t) == (own, other):
+                    return node
+                first = self.first[node]
+                if first > 0:
+                    for c in range(first, first + self.count[node]):
+                        following.append((c, *play(o, t, self.move[c])))
+            level = following
+        return None
+
+    def subtree(self, node, own, other):
+        # Return a new tree holding the subtree under `node`, whose
+        # position is own/other
+        tree = Tree(own, other)
+        tree.visits[0] = self.visits[node]
+        tree.wins[0] = self.wins[node]
+        queue = [(node, 0)]
+        for (old, new) in queue:
+            first = self.first[old]
+            if first < 0:
+                tree.first[new] = -1
+            elif first > 0:
+                start = len(tree)
+                tree.first[new] = start
+                tree.count[new] = self.count[old]
+                for c in range(first, first + self.count[old]):
+                    tree.add(self.move[c], self.visits[c], self.wins[c])
+                    queue.append((c, start + c - first))
+        return tree
+
+
+def search(tree, rng, deadline=None, playouts=None, stop=None):
+    # Grow `tree` until the deadline passes, `playouts` playouts have run
+    # or the `stop` event is set, and return the number of playouts
+    n = 0
+    while playouts is None or n < playouts:
+        tree.iterate(rng)
+        n += 1
+        if not n % CHECK_EVERY:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if stop is not None and stop.is_set():
+                break
+    return n
+
+
+# State of a worker process, set up by _init_worker: its own tree, reused
+# between moves, the event that cancels searches and the barrier all the
+# workers meet at before searching
+_worker_tree = None
+_cancel = None
+_barrier = None
+
+
+def _init_worker(cancel, barrier):
+    global _cancel, _barrier
+    _cancel = cancel
+    _barrier = barrier
+
+
+def _search_worker(own, other, deadline, playouts, seed):
+    # Search a position in a worker process until `deadline`, a time.time()
+    # value, if given, and return the root children's statistics and the
+    # number of playouts. Each task first waits for the others at the
+    # barrier, so that no process takes two of them.
+    global _worker_tree
+    try:
+        _barrier.wait(5)
+    except threading.BrokenBarrierError:
+        pass
+    if deadline is not None:
+        deadline = time.perf_counter() + deadline - time.time()
+    _worker_tree = reuse(_worker_tree, own, other)
+    n = search(_worker_tree, random.Random(seed), deadline, playouts,
+               _cancel)
+    return (_worker_tree.root_stats(), n)
+
+
+def reuse(tree, own, other):
+    # Return the part of `tree` under position own/other, or a new tree if
+    # the position is not in it
+    if tree is not None:
+        node = tree.find(own, other)
+        if node is not None:
+            return tree.subtree(node, own, other)
+    return Tree(own, other)
+
+
+class MCTS:
+    # Monte Carlo tree search with UCT. The tree is kept between moves and
+    # its part under the new position reused. With several workers, each
+    # process grows a tree of its own and their root statistics are added
+    # up. Each process searches one share of every move.
+
+    def __init__(self, workers=1, seed=None):
+        self.workers = workers or os.cpu_count()
+        self.rng = random.Random(seed)
+        self.tree = None
+        self.pool = None
+        self.cancel = None
+        self.barrier = None
+        self.playouts = 0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def best_move(self, board, player, budget_ms=None, playouts=None,
+                  stop=None):
+        # Return the most visited move after searching for `budget_ms`
+        # milliseconds or `playouts` playouts, or until the `stop` event is
+        # set. Return None if there is no move.
+        (black, white) = board.bitmasks()
+        if player == BLACK:
+            (own, other) = (black, white)
+        else:
+            (own, other) = (white, black)
+        moves = legal_moves(own, other)
+        if not moves:
+            return None
+        if not moves & (moves - 1):
+            sq = moves.bit_length() - 1
+            return (sq >> 3, sq & 7)
+
+        if self.workers > 1:
+            stats = self.parallel(own, other, budget_ms, playouts, stop)
+        else:
+            deadline = None
+            if budget_ms is not None:
+                deadline = time.perf_counter() + budget_ms / 1000
+            self.tree = reuse(self.tree, own, other)
+            self.playouts += search(self.tree, self.rng, deadline, playouts,
+                                    stop)
+            stats = self.tree.root_stats()
+        if not stats:
+            # No playout has reached the root's children (playouts=0)
+            sq = (moves & -moves).bit_length() - 1
+            return (sq >> 3, sq & 7)
+        (visits, sq) = max((v, -move) for (move, v, w) in stats)
+        return (-sq >> 3, -sq & 7)
+
+    def parallel(self, own, other, budget_ms, playouts, stop):
+        if self.pool is None:
+            self.cancel = multiprocessing.Event()
+            self.barrier = multiprocessing.Barrier(self.workers)
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.cancel, self.barrier))
+        if playouts is not None:
+            playouts = -(-playouts // self.workers)
+        deadline = None
+        if budget_ms is not None:
+            deadline = time.time() + budget_ms / 1000
+        futures = [self.pool.submit(_search_worker, own, other, deadline,
+                                    playouts, self.rng.getrandbits(64))
+                   for i in range(self.workers)]
+        if stop is not None:
+            # Pass a stop request on to the workers
+            while wait(futures, 0.005).not_done:
+                if stop.is_set():
+                    self.cancel.set()
+                    break
+        totals = {}
+        for future in futures:
+            (stats, n) = future.result()
+            self.playouts += n
+            for (move, v, w) in stats:
+                (visits, wins) = totals.get(move, (0, 0.0))
+                totals[move] = (visits + v, wins + w)
+        self.cancel.clear()
+        return [(move, v, w) for (move, (v, w)) in totals.items()]
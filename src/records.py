@@ -0,0 +1,253 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import reversi
+
+
+# File layout: a header, then one record per game, read and written one at
+# a time so that files of any size take constant memory. A record is a
+# GAME struct (final disc margin for black, lengths of the two player
+# names in bytes and the number of moves), the UTF-8 names of the black
+# and white players, then one byte per move holding its square, 8 * x + y.
+# Passes are not stored: a player with no legal move passes.
+MAGIC = b'RVGR'
+VERSION = 1
+HEADER = struct.Struct('<4sI')
+GAME = struct.Struct('<bBBB')
+
+
+def to_transcript(moves):
+    # Return the squares of `moves` as a string such as 'f5d6c3'
+    return ''.join(reversi.square_name(reversi.POSITIONS[sq]) for sq in moves)
+
+
+def from_transcript(text):
+    # Return the moves of a transcript string as bytes of squares
+    text = text.strip()
+    if len(text) % 2:
+        raise ValueError('bad transcript: {}'.format(text))
+    moves = bytearray()
+    for i in range(0, len(text), 2):
+        (x, y) = reversi.parse_square(text[i:i + 2])
+        if not (0 <= x < 8 and 0 <= y < 8):
+            raise ValueError('bad square: {}'.format(text[i:i + 2]))
+        moves.append(8 * x + y)
+    return bytes(moves)
+
+
+def replay(moves):
+    # Play `moves` (squares) from the start, yielding (board, player, pos)
+    # before each move is made, with the board changed in place; passes are
+    # made as needed. Raise ValueError on an illegal move.
+    board = reversi.BitBoard()
+    player = reversi.BLACK
+    for (i, sq) in enumerate(moves):
+        pos = reversi.POSITIONS[sq]
+        if not board.is_valid(player, pos):
+            player = reversi.opp(player)
+            if not board.is_valid(player, pos):
+                raise ValueError('illegal move {} at move {}'.format(
+                    reversi.square_name(pos), i + 1))
+        yield (board, player, pos)
+        board.make_move(player, pos)
+        player = reversi.opp(player)
+
+
+def margin(moves):
+    # Return black's final disc margin after playing `moves`
+    board = reversi.BitBoard()
+    for (board, player, pos) in replay(moves):
+        pass
+    return board.count(reversi.BLACK) - board.count(reversi.WHITE)
+
+
+def from_game(game, black='', white=''):
+    # Return the record (black, white, margin, moves) of the moves played
+    # so far in a reversi.Game
+    moves = bytes(code & 63 for code in game.codes[:game.ply]
+                  if not code & reversi.MOVE_PASS)
+    return (black, white,
+            game.score(reversi.BLACK) - game.score(reversi.WHITE), moves)
+
+
+class Writer:
+    # Writes game records to a binary file object one at a time
+
+    def __init__(self, f):
+        self.f = f
+        self.games = 0
+        f.write(HEADER.pack(MAGIC, VERSION))
+
+    def write(self, black, white, margin, moves):
+        # Names are cut to 255 bytes, between characters
+        black = black.encode()[:255].decode('utf-8', 'ignore').encode()
+        white = white.encode()[:255].decode('utf-8', 'ignore').encode()
+        self.f.write(GAME.pack(margin, len(black), len(white), len(moves)))
+        self.f.write(black)
+        self.f.write(white)
+        self.f.write(bytes(moves))
+        self.games += 1
+
+
+def read(f):
+    # Yield the records (black, white, margin, moves) of a binary file
+    # object, moves being bytes of squares
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('not a game record file')
+    (magic, version) = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a game record file')
+    while True:
+        data = f.read(GAME.size)
+        if not data:
+            return
+        if len(data) < GAME.size:
+            raise ValueError('truncated game record')
+        (margin, black, white, n) = GAME.unpack(data)
+        data = f.read(black + white + n)
+        if len(data) < black + white + n:
+            raise ValueError('truncated game record')
+        yield (data[:black].decode(), data[black:black + white].decode(),
+               margin, data[black + white:])
+
+
+def read_text(f):
+    # Yield records from a text file object of JSON lines written by
+    # tournament.py, or of one transcript per line
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            record = json.loads(line)
+            moves = from_transcript(record['moves'])
+            if 'black_discs' in record:
+                result = record['black_discs'] - record['white_discs']
+            else:
+                result = margin(moves)
+            yield (str(record.get('black', '')), str(record.get('white', '')),
+                   result, moves)
+        else:
+            moves = from_transcript(line)
+            yield ('', '', margin(moves), moves)
+
+
+# Transposition table of a worker process, kept from game to game
+_worker_tt = None
+
+
+def analyse_game(moves, depth):
+    # Return, for each move of a game, the score of the move played and the
+    # best move with its score, from a fixed-depth search; scores are from
+    # the view of the player making the move
+    global _worker_tt
+    if _worker_tt is None:
+        _worker_tt = reversi.TranspositionTable()
+    tt = _worker_tt
+    tt.new_search()
+    scores = []
+    best = []
+    best_scores = []
+    for (board, player, pos) in replay(moves):
+        search = reversi.Search(board, tt)
+        value = search.negamax(player, depth, -math.inf, math.inf)
+        best.append(tt.best_move(search.key(player)) or pos)
+        best_scores.append(value)
+        flipped = board.make_move(player, pos)
+        scores.append(-search.negamax(reversi.opp(player), depth - 1,
+                                      -math.inf, math.inf))
+        board.unmake_move(player, pos, flipped)
+    return (scores, best, best_scores)
+
+
+def analyse(records, depth=4, workers=None, window=None):
+    # Yield (record, scores, best, best_scores) for each of an iterable of
+    # records, in order, analysing games on a pool of processes. At most
+    # `window` games are in progress or waiting to be yielded at a time, so
+    # that memory stays bounded however many games there are.
+    workers = workers or os.cpu_count()
+    window = window or 4 * workers
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        for record in records:
+            if len(pending) >= window:
+                (done, future) = pending.popleft()
+                yield (done,) + future.result()
+            pending.append((record, pool.submit(analyse_game, record[3],
+                                                depth)))
+        while pending:
+            (done, future) = pending.popleft()
+            yield (done,) + future.result()
+
+
+def open_records(path):
+    # Return an iterator over the records of a binary or text file
+    f = open(path, 'rb')
+    if f.read(len(MAGIC)) == MAGIC:
+        f.seek(0)
+        return read(f)
+    f.close()
+    return read_text(open(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert and analyse game records')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser(
+        'pack', help='write games to a compact record file')
+    pack.add_argument('games', nargs='+',
+                      help='record files, JSON lines files written by '
+                           'tournament.py or files of transcripts')
+    pack.add_argument('-o', '--out', required=True)
+    unpack = commands.add_parser(
+        'unpack', help='print the transcripts of games')
+    unpack.add_argument('games', nargs='+')
+    analyser = commands.add_parser(
+        'analyse', help='score every move of games with the engine')
+    analyser.add_argument('games', nargs='+')
+    analyser.add_argument('-o', '--out', default='analysis.jsonl')
+    analyser.add_argument('--depth', type=int, default=4)
+    analyser.add_argument('-j', '--workers', type=int, default=None,
+                          help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    def records():
+        for path in args.games:
+            yield from open_records(path)
+
+    if args.command == 'pack':
+        with open(args.out, 'wb') as f:
+            writer = Writer(f)
+            for record in records():
+                writer.write(*record)
+        print('{} games written to {}'.format(writer.games, args.out))
+    elif args.command == 'unpack':
+        for (black, white, result, moves) in records():
+            sys.stdout.write(to_transcript(moves) + '\n')
+    else:
+        games = 0
+        with open(args.out, 'w') as out:
+            for (record, scores, best, best_scores) in analyse(
+                    records(), args.depth, args.workers):
+                (black, white, result, moves) = record
+                out.write(json.dumps({
+                    'game': games,
+                    'black': black,
+                    'white': white,
+                    'margin': result,
+                    'moves': to_transcript(moves),
+                    'scores': [round(s, 2) for s in scores],
+                    'best': ''.join(reversi.square_name(pos) for pos in best),
+                    'best_scores': [round(s, 2) for s in best_scores]
+                }) + '\n')
+                games += 1
+        print('{} games analysed into {}'.format(games, args.out))
@@ -1,6 +1,14 @@
 # Author: Ayan Banerjee <ayanb280@gmail.com>
 
 import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
 from copy import deepcopy
 
 
@@ -14,75 +22,171 @@ def opp(player):
         return BLACK
 
 
+def square_name(pos):
+    # Return the name of a square in the usual notation, e.g. 'f5'
+    (x, y) = pos
+    return 'abcdefgh'[y] + str(x + 1)
+
+
+def parse_square(name):
+    return (int(name[1]) - 1, 'abcdefgh'.index(name[0].lower()))
+
+
+# Zobrist keys: a random 64-bit number for each (player, square), and one
+# more that is mixed in when white is to move
+_rng = random.Random(20240601)
+ZOBRIST = {player: [_rng.getrandbits(64) for sq in range(64)]
+           for player in (BLACK, WHITE)}
+ZOBRIST_FLIP = [ZOBRIST[BLACK][sq] ^ ZOBRIST[WHITE][sq] for sq in range(64)]
+ZOBRIST_WHITE = _rng.getrandbits(64)
+
+
+# Score of a finished game per disc of margin. It is larger than any
+# heuristic score, so a won game always beats an unfinished position.
+WIN_SCORE = 1000
+
+
+# Squares are numbered 8 * x + y. POSITIONS maps a square back to (x, y).
+POSITIONS = [(sq >> 3, sq & 7) for sq in range(64)]
+DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1),
+              (1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+
+def _ray(sq, d):
+    (x, y) = POSITIONS[sq]
+    (dx, dy) = d
+    ray = []
+    x += dx
+    y += dy
+    while 0 <= x < 8 and 0 <= y < 8:
+        ray.append(8 * x + y)
+        x += dx
+        y += dy
+    return tuple(ray)
+
+
+# For each square, the squares along each direction outwards from it, in
+# order, split into (first square, rest of the ray). Rays shorter than two
+# squares can never bracket a disc, so they are left out.
+RAYS = [tuple((ray[0], ray[1:]) for ray in (_ray(sq, d) for d in DIRECTIONS)
+              if len(ray) >= 2)
+        for sq in range(64)]
+
+# For each square, the bitmask of the up to eight squares around it
+NEIGHBOURS = [sum(1 << ray[0] for ray in (_ray(sq, d) for d in DIRECTIONS)
+                  if ray)
+              for sq in range(64)]
+
+
 class Board:
     # Represents a game board
 
     def __init__(self):
-        self.board = [[None for i in range(8)] for j in range(8)]
+        self.cells = [None] * 64
+        self.hash = 0
+        # Disc masks and counts kept up to date by set(): all discs, discs
+        # on the corners and discs on the squares next to the corners
+        self.masks = {BLACK: 0, WHITE: 0}
+        self.discs = {BLACK: 0, WHITE: 0}
+        self.corners = {BLACK: 0, WHITE: 0}
+        self.close = {BLACK: 0, WHITE: 0}
         self.set(BLACK, (3, 4))
         self.set(BLACK, (4, 3))
         self.set(WHITE, (3, 3))
         self.set(WHITE, (4, 4))
 
+    @classmethod
+    def from_bitmasks(cls, black, white):
+        board = cls()
+        for pos in POSITIONS:
+            board.set(None, pos)
+        for (player, mask) in ((BLACK, black), (WHITE, white)):
+            for pos in squares(mask):
+                board.set(player, pos)
+        return board
+
     def get(self, pos):
         (x, y) = pos
-        return self.board[x][y]
+        return self.cells[8 * x + y]
 
     def set(self, player, pos):
         (x, y) = pos
-        self.board[x][y] = player
+        sq = 8 * x + y
+        old = self.cells[sq]
+        if old is not None:
+            self.hash ^= ZOBRIST[old][sq]
+            self.masks[old] &= ~(1 << sq)
+            self.discs[old] -= 1
+            if CORNERS >> sq & 1:
+                self.corners[old] -= 1
+            elif CLOSE_TO_CORNERS >> sq & 1:
+                self.close[old] -= 1
+        if player is not None:
+            self.hash ^= ZOBRIST[player][sq]
+            self.masks[player] |= 1 << sq
+            self.discs[player] += 1
+            if CORNERS >> sq & 1:
+                self.corners[player] += 1
+            elif CLOSE_TO_CORNERS >> sq & 1:
+                self.close[player] += 1
+        self.cells[sq] = player
 
     def move(self, player, pos):
-        self.set(player, pos)
-        for d in [(1, 0), (-1, 0), (0, 1), (0, -1),
-                  (1, 1), (-1, 1), (1, -1), (-1, -1)]:
-            (curx, cury) = pos
-            (dx, dy) = d
-            (endx, endy) = self.bracket_piece(player, pos, d)
-            if endx is not None and endy is not None:
-                curx += dx
-                cury += dy
-                while (curx, cury) != (endx, endy):
-                    self.set(player, (curx, cury))
-                    curx += dx
-                    cury += dy
-
-    def bracket_piece(self, player, pos, d):
+        self.make_move(player, pos)
+
+    def make_move(self, player, pos):
+        # Play a move and return the bitmask of flipped discs, which
+        # unmake_move needs to take it back
         (x, y) = pos
-        (dx, dy) = d
-        x += dx
-        y += dy
-        while x in range(8) and y in range(8):
-            if self.get((x, y)) is None:
-                break
-            elif self.get((x, y)) == player:
-                return (x, y)
-            else:
-                x += dx
-                y += dy
-        return (None, None)
+        sq = 8 * x + y
+        cells = self.cells
+        other = opp(player)
+        self.set(player, pos)
+        flipped = 0
+        for (first, rest) in RAYS[sq]:
+            if cells[first] != other:
+                continue
+            for (i, s) in enumerate(rest):
+                cell = cells[s]
+                if cell == player:
+                    self.set(player, POSITIONS[first])
+                    flipped |= 1 << first
+                    for s in rest[:i]:
+                        self.set(player, POSITIONS[s])
+                        flipped |= 1 << s
+                    break
+                elif cell is None:
+                    break
+        return flipped
+
+    def unmake_move(self, player, pos, flipped):
+        # Take back a move played by make_move
+        self.set(None, pos)
+        for flip in squares(flipped):
+            self.set(opp(player), flip)
 
     def move_score(self, player, pos):
+        (x, y) = pos
+        cells = self.cells
+        other = opp(player)
         count = 0
-        for d in [(1, 0), (-1, 0), (0, 1), (0, -1),
-                  (1, 1), (-1, 1), (1, -1), (-1, -1)]:
-            (cur_x, cur_y) = pos
-            (dx, dy) = d
-            (end_x, end_y) = self.bracket_piece(player, pos, d)
-            if end_x is not None and end_y is not None:
-                cur_x += dx
-                cur_y += dy
-                while (cur_x, cur_y) != (end_x, end_y):
-                    count += 1
-                    cur_x += dx
-                    cur_y += dy
+        for (first, rest) in RAYS[8 * x + y]:
+            if cells[first] != other:
+                continue
+            for (i, s) in enumerate(rest):
+                cell = cells[s]
+                if cell == player:
+                    count += i + 1
+                    break
+                elif cell is None:
+                    break
         return count
 
     def is_valid(self, player, pos):
         (x, y) = pos
         if x not in range(8) or y not in range(8):
             return False
-        elif self.get(pos) is not None:
+        elif self.cells[8 * x + y] is not None:
             return False
         else:
             if self.move_score(player, (x, y)) == 0:
@@ -91,33 +195,51 @@ class Board:
                 return True
 
     def avl_moves(self, player):
+        cells = self.cells
+        other = opp(player)
+        others = self.masks[other]
         moves = []
-        for i in range(8):
-            for j in range(8):
-                if self.is_valid(player, (i, j)):
-                    moves.append((i, j))
+        for sq in range(64):
+            # Only empty squares next to an opponent disc can be moves
+            if cells[sq] is not None or not NEIGHBOURS[sq] & others:
+                continue
+            for (first, rest) in RAYS[sq]:
+                if cells[first] != other:
+                    continue
+                for s in rest:
+                    cell = cells[s]
+                    if cell != other:
+                        break
+                if cell == player:
+                    moves.append(POSITIONS[sq])
+                    break
         return moves
 
+    def bitmasks(self):
+        # Return the (black, white) disc masks of the position
+        return (self.masks[BLACK], self.masks[WHITE])
+
     def count(self, player):
-        count = 0
-        for i in range(8):
-            for j in range(8):
-                if self.get((i, j)) == player:
-                    count += 1
-        return count
+        return self.discs[player]
 
     def basic_evaluate(self, player):
         return self.count(player) - self.count(opp(player))
 
+    def final_score(self, player):
+        # Score of a finished game: the disc margin, scaled so that any win
+        # beats any evaluation
+        return self.basic_evaluate(player) * WIN_SCORE
+
     def evaluate(self, player):
-        if not self.avl_moves(player):
-            if not self.avl_moves(opp(player)):
-                return (self.count(player) -
-                        self.count(opp(player))) * math.inf
-
-                # Piece difference
-        x = self.count(player)
-        y = self.count(opp(player))
+        other = opp(player)
+        own_moves = len(self.avl_moves(player))
+        other_moves = len(self.avl_moves(other))
+        if not own_moves and not other_moves:
+            return (self.discs[player] - self.discs[other]) * WIN_SCORE
+
+        # Piece difference
+        x = self.discs[player]
+        y = self.discs[other]
         if x > y:
             p = 100 * x / (x + y)
         elif x < y:
@@ -126,27 +248,13 @@ class Board:
             p = 0
 
         # Corner occupancy
-        x = y = 0
-        for pos in [(0, 0), (7, 0), (0, 7), (7, 7)]:
-            if self.get(pos) == player:
-                x += 1
-            elif self.get(pos) == opp(player):
-                y += 1
-        c = 25 * (x - y)
+        c = 25 * (self.corners[player] - self.corners[other])
 
         # Corner closeness
-        x = y = 0
-        for pos in[(0, 1), (1, 0), (1, 1), (6, 0), (7, 1), (6, 1),
-                   (0, 6), (1, 7), (1, 6), (6, 7), (7, 6), (6, 6)]:
-            if self.get(pos) == player:
-                x += 1
-            elif self.get(pos) == opp(player):
-                y += 1
-        l = -12.5 * (x - y)
+        l = -12.5 * (self.close[player] - self.close[other])
 
         # Mobility
-        x = len(self.avl_moves(player))
-        y = len(self.avl_moves(opp(player)))
+        x, y = own_moves, other_moves
         if x > y:
             m = 100 * x / (x + y)
         elif x < y:
@@ -164,29 +272,16 @@ class Board:
             best_pos = moves[0]
             best_score = -math.inf
             for pos in moves:
-                child = deepcopy(self)
-                child.move(player, pos)
-                cur_score = child.evaluate(player)
+                flipped = self.make_move(player, pos)
+                cur_score = self.evaluate(player)
+                self.unmake_move(player, pos, flipped)
                 if cur_score > best_score:
                     best_pos = pos
                     best_score = cur_score
             return best_pos
 
-    def gen_minimax_move(self, player, depth=5):
-        moves = self.avl_moves(player)
-        if not moves:
-            return None
-        else:
-            best_pos = moves[0]
-            best_score = -math.inf
-            for pos in moves:
-                board = deepcopy(self)
-                board.move(player, pos)
-                cur_score = board.minimax(opp(player), player, depth - 1)
-                if cur_score > best_score:
-                    best_pos = pos
-                    best_score = cur_score
-            return best_pos
+    def gen_minimax_move(self, player, depth=5, tt=None, stats=None):
+        return Search(self, tt, stats=stats).best_move(player, depth)
 
     def minimax(
             self,
@@ -196,97 +291,1449 @@ class Board:
             alpha=-
             math.inf,
             beta=math.inf):
-        if depth == 0:
-            return self.evaluate(maxplayer)
+        # Value of the position for maxplayer with cur_player to move
+        search = Search(self)
+        if cur_player == maxplayer:
+            return search.negamax(cur_player, depth, alpha, beta)
         else:
-            moves = self.avl_moves(cur_player)
+            return -search.negamax(cur_player, depth, -beta, -alpha)
+
+
+# Bitboard layout: square (x, y) is bit 8 * x + y of a 64-bit integer
+FULL = 0xFFFFFFFFFFFFFFFF
+CORNERS = 0x8100000000000081
+CLOSE_TO_CORNERS = 0x42C300000000C342
+
+# (shift, mask) for the four line directions. Shifting left and right by
+# the same amount covers both senses of a direction; the mask removes
+# opponent discs on columns that would wrap around to the next row.
+SHIFTS = ((1, 0x7E7E7E7E7E7E7E7E), (8, FULL),
+          (7, 0x7E7E7E7E7E7E7E7E), (9, 0x7E7E7E7E7E7E7E7E))
+
+
+def legal_moves(own, other):
+    # Return the bitmask of squares where the owner of `own` may move
+    empty = ~(own | other) & FULL
+    moves = 0
+    for shift, mask in SHIFTS:
+        o = other & mask
+        t = o & (own << shift)
+        t |= o & (t << shift)
+        t |= o & (t << shift)
+        t |= o & (t << shift)
+        t |= o & (t << shift)
+        t |= o & (t << shift)
+        moves |= empty & (t << shift)
+        t = o & (own >> shift)
+        t |= o & (t >> shift)
+        t |= o & (t >> shift)
+        t |= o & (t >> shift)
+        t |= o & (t >> shift)
+        t |= o & (t >> shift)
+        moves |= empty & (t >> shift)
+    return moves
+
+
+def flips(own, other, sq):
+    # Return the bitmask of discs flipped when the owner of `own` plays `sq`
+    bit = 1 << sq
+    result = 0
+    for shift, mask in SHIFTS:
+        o = other & mask
+        f = 0
+        x = bit << shift
+        while x & o:
+            f |= x
+            x <<= shift
+        if x & own:
+            result |= f
+        f = 0
+        x = bit >> shift
+        while x & o:
+            f |= x
+            x >>= shift
+        if x & own:
+            result |= f
+    return result
+
+
+def flips_hash(mask):
+    # Return the change in Zobrist hash from flipping the discs in `mask`
+    h = 0
+    while mask:
+        bit = mask & -mask
+        h ^= ZOBRIST_FLIP[bit.bit_length() - 1]
+        mask ^= bit
+    return h
+
+
+def squares(mask):
+    # Return the (x, y) positions of the set bits of `mask`, row by row
+    result = []
+    while mask:
+        bit = mask & -mask
+        sq = bit.bit_length() - 1
+        result.append((sq >> 3, sq & 7))
+        mask ^= bit
+    return result
+
+
+class BitBoard(Board):
+    # Represents a game board as one 64-bit disc mask per player
+
+    # MoveCache consulted for legal moves, if any. Copies of a board start
+    # without one.
+    cache = None
+
+    def __init__(self):
+        self.discs = {BLACK: 0, WHITE: 0}
+        self.hash = 0
+        self.set(BLACK, (3, 4))
+        self.set(BLACK, (4, 3))
+        self.set(WHITE, (3, 3))
+        self.set(WHITE, (4, 4))
+
+    def __deepcopy__(self, memo):
+        board = BitBoard.__new__(BitBoard)
+        board.discs = self.discs.copy()
+        board.hash = self.hash
+        return board
+
+    @classmethod
+    def from_bitmasks(cls, black, white):
+        board = cls.__new__(cls)
+        board.discs = {BLACK: black, WHITE: white}
+        board.hash = 0
+        for (player, mask) in ((BLACK, black), (WHITE, white)):
+            for (x, y) in squares(mask):
+                board.hash ^= ZOBRIST[player][8 * x + y]
+        return board
+
+    def bitmasks(self):
+        return (self.discs[BLACK], self.discs[WHITE])
+
+    def get(self, pos):
+        (x, y) = pos
+        bit = 1 << (8 * x + y)
+        if self.discs[BLACK] & bit:
+            return BLACK
+        elif self.discs[WHITE] & bit:
+            return WHITE
+        return None
+
+    def set(self, player, pos):
+        (x, y) = pos
+        sq = 8 * x + y
+        old = self.get(pos)
+        if old is not None:
+            self.discs[old] &= ~(1 << sq)
+            self.hash ^= ZOBRIST[old][sq]
+        if player is not None:
+            self.discs[player] |= 1 << sq
+            self.hash ^= ZOBRIST[player][sq]
+
+    def make_move(self, player, pos):
+        (x, y) = pos
+        sq = 8 * x + y
+        discs = self.discs
+        other = opp(player)
+        if (discs[player] | discs[other]) >> sq & 1:
+            # As in Board, whatever set() put on the square is replaced
+            self.set(None, pos)
+        f = flips(discs[player], discs[other], sq)
+        discs[player] |= f | (1 << sq)
+        discs[other] &= ~(f | (1 << sq))
+        self.hash ^= ZOBRIST[player][sq] ^ flips_hash(f)
+        return f
+
+    def unmake_move(self, player, pos, flipped):
+        (x, y) = pos
+        sq = 8 * x + y
+        discs = self.discs
+        discs[player] &= ~(flipped | (1 << sq))
+        discs[opp(player)] |= flipped
+        self.hash ^= ZOBRIST[player][sq] ^ flips_hash(flipped)
+
+    def move_score(self, player, pos):
+        (x, y) = pos
+        return flips(self.discs[player], self.discs[opp(player)],
+                     8 * x + y).bit_count()
+
+    def legal(self, own, other):
+        if self.cache is None:
+            return legal_moves(own, other)
+        return self.cache.moves(own, other)
+
+    def is_valid(self, player, pos):
+        (x, y) = pos
+        if x not in range(8) or y not in range(8):
+            return False
+        return bool(self.legal(self.discs[player], self.discs[opp(player)])
+                    >> (8 * x + y) & 1)
+
+    def avl_moves(self, player):
+        return squares(self.legal(self.discs[player],
+                                  self.discs[opp(player)]))
+
+    def count(self, player):
+        return self.discs[player].bit_count()
+
+    def evaluate(self, player):
+        own = self.discs[player]
+        other = self.discs[opp(player)]
+        own_moves = self.legal(own, other).bit_count()
+        other_moves = self.legal(other, own).bit_count()
+        x = own.bit_count()
+        y = other.bit_count()
+        if not own_moves and not other_moves:
+            return (x - y) * WIN_SCORE
+
+        # Piece difference
+        if x > y:
+            p = 100 * x / (x + y)
+        elif x < y:
+            p = -100 * y / (x + y)
+        else:
+            p = 0
+
+        # Corner occupancy
+        c = 25 * ((own & CORNERS).bit_count() -
+                  (other & CORNERS).bit_count())
+
+        # Corner closeness
+        l = -12.5 * ((own & CLOSE_TO_CORNERS).bit_count() -
+                     (other & CLOSE_TO_CORNERS).bit_count())
+
+        # Mobility
+        x, y = own_moves, other_moves
+        if x > y:
+            m = 100 * x / (x + y)
+        elif x < y:
+            m = -100 * y / (x + y)
+        else:
+            m = 0
+
+        return p + c + l + m
+
+
+# Pattern evaluation: the board is read as lines and blocks of squares
+# (edges with their X squares, 3x3 corners, 2x5 corner blocks and
+# diagonals), in every orientation. Each is a base-3 number with one digit
+# per square, 0 for empty, 1 for black and 2 for white, and indexes a table
+# of weights fitted by fit.py, one set of tables per game phase. The sum of
+# the weights estimates the final disc margin for black.
+PATTERN_SHAPES = [
+    ('edge', [0, 1, 2, 3, 4, 5, 6, 7, 9, 14]),
+    ('corner', [0, 1, 2, 8, 9, 10, 16, 17, 18]),
+    ('block', [0, 1, 2, 3, 4, 8, 9, 10, 11, 12]),
+    ('diagonal8', [9 * i for i in range(8)]),
+    ('diagonal7', [9 * i + 1 for i in range(7)]),
+    ('diagonal6', [9 * i + 2 for i in range(6)]),
+    ('diagonal5', [9 * i + 3 for i in range(5)]),
+    ('diagonal4', [9 * i + 4 for i in range(4)])
+]
+
+PATTERN_WEIGHTS = 'res/weights.bin'
+
+
+def _orientations(squares):
+    # Return the images of a list of squares under the 8 symmetries of the
+    # board, leaving out those covering the same squares as an earlier one
+    images = []
+    seen = set()
+    for t in range(8):
+        image = []
+        for sq in squares:
+            (x, y) = (sq >> 3, sq & 7)
+            if t & 4:
+                (x, y) = (y, x)
+            if t & 2:
+                x = 7 - x
+            if t & 1:
+                y = 7 - y
+            image.append(8 * x + y)
+        if frozenset(image) not in seen:
+            seen.add(frozenset(image))
+            images.append(image)
+    return images
+
+
+# Offset of each shape's table among the weights of a phase; the last
+# weight of a phase is a constant
+PATTERN_OFFSETS = []
+PATTERN_SIZE = 0
+for (name, shape) in PATTERN_SHAPES:
+    PATTERN_OFFSETS.append(PATTERN_SIZE)
+    PATTERN_SIZE += 3 ** len(shape)
+PATTERN_SIZE += 1
+
+# Every pattern on the board as (shape index, squares), and the (pattern,
+# power of 3) pairs of the patterns each square is in
+PATTERNS = [(i, image) for (i, (name, shape)) in enumerate(PATTERN_SHAPES)
+            for image in _orientations(shape)]
+SQUARE_PATTERNS = [[] for sq in range(64)]
+for (p, (shape, members)) in enumerate(PATTERNS):
+    for (k, sq) in enumerate(members):
+        SQUARE_PATTERNS[sq].append((p, 3 ** k))
+
+DIGITS = {None: 0, BLACK: 1, WHITE: 2}
+
+
+def pattern_codes(black, white):
+    # Return the table index of every pattern of a position
+    codes = []
+    for (shape, members) in PATTERNS:
+        code = 0
+        for sq in reversed(members):
+            code = 3 * code + (black >> sq & 1) + 2 * (white >> sq & 1)
+        codes.append(PATTERN_OFFSETS[shape] + code)
+    return codes
+
+
+class PatternWeights:
+    # Weight tables read from a file written by fit.py: a header, then for
+    # each phase PATTERN_SIZE little-endian int16 weights in units of
+    # `scale` discs
+
+    MAGIC = b'RVPW'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIIIf')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            (magic, version, phases, size, self.scale) = \
+                self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC or version != self.VERSION or \
+                    size != PATTERN_SIZE:
+                raise ValueError('not a pattern weights file: {}'.format(
+                    path))
+            self.tables = []
+            for i in range(phases):
+                table = array('h')
+                table.fromfile(f, size)
+                if sys.byteorder == 'big':
+                    table.byteswap()
+                self.tables.append(table)
+        # Table to use at each disc count
+        self.phase = [self.tables[max(0, min(phases - 1,
+                                             (n - 4) * phases // 61))]
+                      for n in range(65)]
+
+
+class PatternBoard(BitBoard):
+    # Bitboard evaluated with pattern tables, whose pattern codes it keeps
+    # up to date move by move instead of scanning the board at each leaf
+
+    # Weights shared by all pattern boards, read from PATTERN_WEIGHTS when
+    # the first board is made unless set before
+    weights = None
+
+    def __init__(self):
+        self.load()
+        self.codes = [PATTERN_OFFSETS[shape] for (shape, members) in
+                      PATTERNS]
+        super().__init__()
+
+    @classmethod
+    def load(cls):
+        if cls.weights is None:
+            cls.weights = PatternWeights(PATTERN_WEIGHTS)
+
+    def __deepcopy__(self, memo):
+        board = PatternBoard.__new__(PatternBoard)
+        board.discs = self.discs.copy()
+        board.hash = self.hash
+        board.codes = self.codes.copy()
+        return board
+
+    @classmethod
+    def from_bitmasks(cls, black, white):
+        cls.load()
+        board = super().from_bitmasks(black, white)
+        board.codes = pattern_codes(black, white)
+        return board
+
+    def set(self, player, pos):
+        (x, y) = pos
+        d = DIGITS[player] - DIGITS[self.get(pos)]
+        super().set(player, pos)
+        for (p, power) in SQUARE_PATTERNS[8 * x + y]:
+            self.codes[p] += d * power
+
+    def make_move(self, player, pos):
+        f = super().make_move(player, pos)
+        self.update(player, pos, f, 1)
+        return f
+
+    def unmake_move(self, player, pos, flipped):
+        super().unmake_move(player, pos, flipped)
+        self.update(player, pos, flipped, -1)
+
+    def update(self, player, pos, flipped, sign):
+        # Apply the changes of a move to the pattern codes, or with sign -1
+        # take them back
+        codes = self.codes
+        (x, y) = pos
+        d = sign * DIGITS[player]
+        for (p, power) in SQUARE_PATTERNS[8 * x + y]:
+            codes[p] += d * power
+        # A flipped disc goes from 2 to 1 for black, from 1 to 2 for white
+        d = -sign if player == BLACK else sign
+        while flipped:
+            sq = (flipped & -flipped).bit_length() - 1
+            flipped &= flipped - 1
+            for (p, power) in SQUARE_PATTERNS[sq]:
+                codes[p] += d * power
+
+    def evaluate(self, player):
+        # Like Board.evaluate, score a finished game by its result, which
+        # negamax relies on at depth 0
+        (black, white) = (self.discs[BLACK], self.discs[WHITE])
+        discs = (black | white).bit_count()
+        if discs == 64 or not (self.legal(black, white) or
+                               self.legal(white, black)):
+            return self.final_score(player)
+        table = self.weights.phase[discs]
+        v = (sum(map(table.__getitem__, self.codes)) +
+             table[PATTERN_SIZE - 1]) * self.weights.scale
+        return v if player == BLACK else -v
+
+
+# Order in which the search tries squares when it knows nothing better:
+# corners first, then edges and the centre, and the squares next to the
+# corners last
+SQUARE_PRIORITY = {}
+for (x, row) in enumerate([[9, 1, 7, 6, 6, 7, 1, 9],
+                           [1, 0, 3, 3, 3, 3, 0, 1],
+                           [7, 3, 5, 4, 4, 5, 3, 7],
+                           [6, 3, 4, 4, 4, 4, 3, 6],
+                           [6, 3, 4, 4, 4, 4, 3, 6],
+                           [7, 3, 5, 4, 4, 5, 3, 7],
+                           [1, 0, 3, 3, 3, 3, 0, 1],
+                           [9, 1, 7, 6, 6, 7, 1, 9]]):
+    for (y, priority) in enumerate(row):
+        SQUARE_PRIORITY[(x, y)] = priority
+
+# Quadrant of each square, used for parity ordering in the endgame
+QUADRANT = [(sq >> 5) * 2 + ((sq & 7) >> 2) for sq in range(64)]
+
+# Below this many empty squares the endgame solver orders moves by parity
+# alone rather than by the opponent's mobility
+PARITY_EMPTIES = 7
+
+# Bound types of transposition table entries
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    # Fixed-size table of search results keyed by Zobrist hash. Each slot
+    # holds two entries: one that keeps the deepest result (unless it is
+    # left over from an earlier search) and one that is always replaced.
+
+    # Approximate size of one stored entry in bytes, used to turn the
+    # memory cap into a slot count
+    ENTRY_SIZE = 200
+
+    def __init__(self, megabytes=16):
+        slots = 1
+        while 4 * slots * self.ENTRY_SIZE <= megabytes * 2 ** 20:
+            slots *= 2
+        self.mask = slots - 1
+        self.deep = [None] * slots
+        self.recent = [None] * slots
+        self.generation = 0
+        self.hits = self.misses = self.collisions = 0
+
+    def __deepcopy__(self, memo):
+        # Snapshots of a game share its table rather than copying it
+        return self
+
+    def new_search(self):
+        # Mark the entries stored so far as belonging to an older search
+        self.generation += 1
+
+    def clear(self):
+        self.deep = [None] * (self.mask + 1)
+        self.recent = [None] * (self.mask + 1)
+        self.hits = self.misses = self.collisions = 0
+
+    def probe(self, key):
+        # Return (depth, bound, value, move) stored for `key`, or None
+        i = key & self.mask
+        entry = self.deep[i]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        other = self.recent[i]
+        if other is not None and other[0] == key:
+            self.hits += 1
+            return other[1:5]
+        self.misses += 1
+        if entry is not None or other is not None:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        i = key & self.mask
+        entry = (key, depth, bound, value, move, self.generation)
+        old = self.deep[i]
+        if (old is None or old[0] == key or depth >= old[1] or
+                old[5] != self.generation):
+            self.deep[i] = entry
+        else:
+            self.recent[i] = entry
+
+    def best_move(self, key):
+        # Return the move stored for `key` without counting a probe
+        i = key & self.mask
+        for entry in (self.deep[i], self.recent[i]):
+            if entry is not None and entry[0] == key:
+                return entry[4]
+        return None
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+
+class MoveCache:
+    # Legal move masks by position, for at most `size` positions, the least
+    # recently used making way for a new one. Searches meet the same
+    # positions again at each iteration, and the evaluation works out the
+    # moves a deeper search then asks for. Not to be used by two threads at
+    # once.
+
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.entries = {}
+        self.hits = self.misses = 0
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def moves(self, own, other):
+        # Return legal_moves(own, other)
+        key = (own, other)
+        entries = self.entries
+        moves = entries.pop(key, None)
+        if moves is None:
+            self.misses += 1
+            moves = legal_moves(own, other)
+            if len(entries) >= self.size:
+                del entries[next(iter(entries))]
+        else:
+            self.hits += 1
+        # Insertion order is the order of use
+        entries[key] = moves
+        return moves
+
+    def clear(self):
+        self.entries = {}
+        self.hits = self.misses = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SearchStats:
+    # Counters filled in by a search it is passed to. Nodes are copied in
+    # every Search.CHECK_EVERY nodes, so they can be read while it runs.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.nodes = 0
+        self.leaves = 0
+        self.passes = 0
+        self.cutoffs = 0
+        # Number of beta cutoffs caused by the n-th move tried, by n
+        self.cutoff_index = {}
+        self.depth = 0
+        self.max_ply = 0
+        self.time = {'avl_moves': 0.0, 'evaluate': 0.0, 'move': 0.0}
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def nodes_per_second(self):
+        elapsed = self.elapsed()
+        return self.nodes / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'leaves': self.leaves,
+            'passes': self.passes,
+            'cutoffs': self.cutoffs,
+            'cutoff_index': dict(sorted(self.cutoff_index.items())),
+            'depth': self.depth,
+            'max_ply': self.max_ply,
+            'seconds': self.elapsed(),
+            'time': dict(self.time)
+        }
+
+
+class _TimedBoard:
+    # Wraps a board to time the calls a search makes to it. Only used when
+    # statistics are collected, so that plain searches pay nothing.
+
+    def __init__(self, board, stats):
+        self._board = board
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._board, name)
+
+    def avl_moves(self, player):
+        start = time.perf_counter()
+        moves = self._board.avl_moves(player)
+        self._stats.time['avl_moves'] += time.perf_counter() - start
+        return moves
+
+    def evaluate(self, player):
+        start = time.perf_counter()
+        score = self._board.evaluate(player)
+        self._stats.time['evaluate'] += time.perf_counter() - start
+        self._stats.leaves += 1
+        return score
+
+    def make_move(self, player, pos):
+        start = time.perf_counter()
+        flipped = self._board.make_move(player, pos)
+        self._stats.time['move'] += time.perf_counter() - start
+        return flipped
+
+    def unmake_move(self, player, pos, flipped):
+        start = time.perf_counter()
+        self._board.unmake_move(player, pos, flipped)
+        self._stats.time['move'] += time.perf_counter() - start
+
+
+class Search:
+    # Alpha-beta search on a board, which is changed in place and restored
+    # before returning. Scores are from the view of the player to move.
+
+    # Number of nodes between two checks of the clock
+    CHECK_EVERY = 256
+
+    # Width of the null window used to test whether a move beats alpha
+    NULL_WINDOW = 1e-9
+
+    def __init__(self, board, tt=None, ordering=True, stats=None, stop=None):
+        # With ordering=False moves are searched in the order avl_moves
+        # returns them (apart from the table move) with full windows. The
+        # search gives up, as when out of time, once the `stop` event is
+        # set.
+        if stats is not None:
+            board = _TimedBoard(board, stats)
+        self.board = board
+        self.tt = tt
+        self.ordering = ordering
+        self.stats = stats
+        self.nodes = 0
+        self.reported = 0
+        self.depth = 0
+        self.deadline = None
+        self.stop = stop
+        self.stopped = False
+        self.pv = {}
+        self.killers = [None] * 128
+        self.history = {}
+
+    def key(self, player):
+        if player == WHITE:
+            return self.board.hash ^ ZOBRIST_WHITE
+        return self.board.hash
+
+    def iterate(self, player, budget_ms, max_depth=64):
+        # Search one ply deeper at a time until the time budget runs out,
+        # and return the best move of the last iteration that finished
+        board = self.board
+        start = time.perf_counter()
+        self.deadline = start + budget_ms / 1000
+        if self.tt is None:
+            self.tt = TranspositionTable(1)
+        moves = board.avl_moves(player)
+        if not moves:
+            return None
+        best_pos = moves[0]
+        if len(moves) == 1:
+            return best_pos
+        empties = 64 - board.count(BLACK) - board.count(WHITE)
+        for depth in range(1, min(max_depth, empties) + 1):
+            pos = self.best_move(player, depth)
+            if self.stopped:
+                break
+            best_pos = pos
+            self.pv = self.principal_variation(player, depth)
+            # The next iteration takes several times longer than this one,
+            # so don't start it if it can't finish
+            if time.perf_counter() - start > budget_ms / 2000:
+                break
+        self.finish()
+        return best_pos
+
+    def principal_variation(self, player, depth):
+        # Follow the best moves stored in the table from the root and
+        # return them as a {key: move} map
+        board = self.board
+        pv = {}
+        made = []
+        while len(made) < depth:
+            moves = board.avl_moves(player)
             if not moves:
-                if not self.avl_moves(opp(cur_player)):
-                    return self.evaluate(maxplayer)
-                else:
-                    child = deepcopy(self)
-                    return child.minimax(
-                        opp(cur_player), maxplayer, depth, alpha, beta)
+                if not board.avl_moves(opp(player)):
+                    break
+                player = opp(player)
+                continue
+            key = self.key(player)
+            pos = self.tt.best_move(key)
+            if pos not in moves:
+                break
+            pv[key] = pos
+            made.append((player, pos, board.make_move(player, pos)))
+            player = opp(player)
+        for (player, pos, flipped) in reversed(made):
+            board.unmake_move(player, pos, flipped)
+        return pv
+
+    def best_move(self, player, depth):
+        board = self.board
+        moves = board.avl_moves(player)
+        if not moves:
+            return None
+        key = self.key(player)
+        self.order(moves, 0, self.pv.get(key))
+        best_pos = moves[0]
+        best_score = -math.inf
+        for pos in moves:
+            flipped = board.make_move(player, pos)
+            if pos == moves[0] or not self.ordering:
+                cur_score = -self.negamax(opp(player), depth - 1,
+                                          -math.inf, -best_score, 1)
+            else:
+                cur_score = -self.negamax(
+                    opp(player), depth - 1,
+                    -best_score - self.NULL_WINDOW, -best_score, 1)
+                if cur_score > best_score:
+                    cur_score = -self.negamax(opp(player), depth - 1,
+                                              -math.inf, -best_score, 1)
+            board.unmake_move(player, pos, flipped)
+            if self.stopped:
+                return None
+            if cur_score > best_score:
+                best_pos = pos
+                best_score = cur_score
+        if self.tt is not None:
+            self.tt.store(key, depth, EXACT, best_score, best_pos)
+        self.depth = depth
+        if self.stats is not None:
+            self.stats.depth = depth
+        self.finish()
+        return best_pos
+
+    def order(self, moves, ply, hint):
+        # Sort moves best first: the move suggested by the table or the
+        # principal variation, then the killer move of this ply, then by
+        # history score, with ties broken by a static square priority
+        if not self.ordering:
+            if hint in moves and hint != moves[0]:
+                moves.remove(hint)
+                moves.insert(0, hint)
+            return
+        killer = self.killers[ply]
+        history = self.history
+        moves.sort(key=lambda pos: (pos == hint, pos == killer,
+                                    history.get(pos, 0),
+                                    SQUARE_PRIORITY[pos]),
+                   reverse=True)
+
+    def poll(self):
+        # Called every CHECK_EVERY nodes
+        self.finish()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.stop is not None and self.stop.is_set():
+            self.stopped = True
+
+    def finish(self):
+        # Add the nodes searched since the last call to the statistics
+        if self.stats is not None:
+            self.stats.nodes += self.nodes - self.reported
+            self.reported = self.nodes
+
+    def negamax(self, player, depth, alpha, beta, ply=0):
+        board = self.board
+        self.nodes += 1
+        if not self.nodes % self.CHECK_EVERY:
+            self.poll()
+        if self.stopped:
+            return 0
+        if depth == 0:
+            if self.stats is not None and ply > self.stats.max_ply:
+                self.stats.max_ply = ply
+            return board.evaluate(player)
+
+        tt = self.tt
+        tt_move = None
+        if tt is not None:
+            key = self.key(player)
+            entry = tt.probe(key)
+            if entry is not None:
+                (tt_depth, bound, value, tt_move) = entry
+                # Only cut on results of the same depth, so that the
+                # table never changes what a fixed-depth search returns
+                if tt_depth == depth:
+                    if bound == EXACT:
+                        return value
+                    elif bound == LOWER and value >= beta:
+                        return value
+                    elif bound == UPPER and value <= alpha:
+                        return value
+            if self.pv:
+                tt_move = self.pv.get(key, tt_move)
+
+        moves = board.avl_moves(player)
+        if not moves:
+            if not board.avl_moves(opp(player)):
+                return board.final_score(player)
+            if self.stats is not None:
+                self.stats.passes += 1
+            return -self.negamax(opp(player), depth, -beta, -alpha, ply + 1)
+        if len(moves) > 1:
+            self.order(moves, ply, tt_move)
+
+        alpha_orig = alpha
+        best = -math.inf
+        best_pos = moves[0]
+        for pos in moves:
+            flipped = board.make_move(player, pos)
+            if best == -math.inf or not self.ordering:
+                v = -self.negamax(opp(player), depth - 1, -beta, -alpha,
+                                  ply + 1)
             else:
-                if cur_player == maxplayer:
-                    v = -math.inf
-                    for pos in moves:
-                        child = deepcopy(self)
-                        child.move(cur_player, pos)
-                        v = max(
-                            v,
-                            child.minimax(
-                                opp(cur_player),
-                                maxplayer,
-                                depth - 1,
-                                alpha,
-                                beta))
-                        alpha = max(alpha, v)
-                        if beta <= alpha:
-                            break
-                    return v
+                # Principal variation search: prove with a null window
+                # that the move is no better than alpha, and search it
+                # again with the full window only if that fails
+                v = -self.negamax(opp(player), depth - 1,
+                                  -alpha - self.NULL_WINDOW, -alpha, ply + 1)
+                if alpha < v < beta:
+                    v = -self.negamax(opp(player), depth - 1, -beta, -alpha,
+                                      ply + 1)
+            board.unmake_move(player, pos, flipped)
+            if self.stopped:
+                return 0
+            if v > best:
+                best = v
+                best_pos = pos
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta:
+                        self.killers[ply] = pos
+                        self.history[pos] = (self.history.get(pos, 0) +
+                                             depth * depth)
+                        if self.stats is not None:
+                            self.stats.cutoffs += 1
+                            i = moves.index(pos)
+                            self.stats.cutoff_index[i] = (
+                                self.stats.cutoff_index.get(i, 0) + 1)
+                        break
+
+        if tt is not None:
+            if best <= alpha_orig:
+                bound = UPPER
+            elif best >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            tt.store(key, depth, bound, best, best_pos)
+        return best
+
+    def solve(self, player, budget_ms=None):
+        # Search to the end of the game and return the best move and the
+        # final disc margin it leads to, or (None, None) if time ran out
+        if budget_ms is not None:
+            self.deadline = time.perf_counter() + budget_ms / 1000
+        (black, white) = self.board.bitmasks()
+        if player == BLACK:
+            (own, other) = (black, white)
+        else:
+            (own, other) = (white, black)
+        moves = legal_moves(own, other)
+        if not moves:
+            return (None, None)
+        # Empty squares, best square first, which the solver keeps in step
+        # with the moves it tries
+        empty = ~(own | other) & FULL
+        self.empties = sorted(
+            (sq for sq in range(64) if empty >> sq & 1),
+            key=lambda sq: -SQUARE_PRIORITY[(sq >> 3, sq & 7)])
+        best_pos = None
+        alpha = -65
+        for sq in self.solve_order(own, other, moves):
+            f = flips(own, other, sq)
+            self.empties.remove(sq)
+            v = -self.solve_node(other & ~f, own | f | (1 << sq),
+                                 -65, -alpha)
+            self.empties.append(sq)
+            if self.stopped:
+                return (None, None)
+            if v > alpha:
+                alpha = v
+                best_pos = (sq >> 3, sq & 7)
+        self.score = alpha
+        if self.stats is not None:
+            self.stats.depth = self.stats.max_ply = len(self.empties)
+        self.finish()
+        return (best_pos, alpha)
+
+    def solve_order(self, own, other, moves):
+        # Return the squares of `moves` in the order to try them: with many
+        # empties, fastest first (fewest replies for the opponent); with
+        # few, squares in regions with an odd number of empties first
+        empties = self.empties
+        if len(empties) > PARITY_EMPTIES:
+            replies = []
+            for sq in empties:
+                if moves >> sq & 1:
+                    f = flips(own, other, sq)
+                    mobility = legal_moves(other & ~f,
+                                           own | f | (1 << sq)).bit_count()
+                    replies.append((mobility, sq))
+            replies.sort()
+            return [sq for (mobility, sq) in replies]
+        parity = 0
+        for sq in empties:
+            parity ^= 1 << QUADRANT[sq]
+        odd = []
+        even = []
+        for sq in empties:
+            if moves >> sq & 1:
+                if parity >> QUADRANT[sq] & 1:
+                    odd.append(sq)
                 else:
-                    v = math.inf
-                    for pos in moves:
-                        child = deepcopy(self)
-                        child.move(cur_player, pos)
-                        v = min(
-                            v,
-                            child.minimax(
-                                opp(cur_player),
-                                maxplayer,
-                                depth - 1,
-                                alpha,
-                                beta))
-                        beta = min(beta, v)
-                        if beta <= alpha:
-                            break
-                    return v
+                    even.append(sq)
+        return odd + even
+
+    def solve_node(self, own, other, alpha, beta):
+        self.nodes += 1
+        if not self.nodes % self.CHECK_EVERY:
+            self.poll()
+        if self.stopped:
+            return 0
+        empties = self.empties
+        if len(empties) == 1:
+            # Last empty square: play it by whoever can, and count
+            sq = empties[0]
+            f = flips(own, other, sq)
+            if f:
+                n = f.bit_count()
+                return own.bit_count() + n + 1 - other.bit_count() + n
+            f = flips(other, own, sq)
+            if f:
+                n = f.bit_count()
+                return own.bit_count() - n - other.bit_count() - n - 1
+            return own.bit_count() - other.bit_count()
+
+        moves = legal_moves(own, other)
+        if not moves:
+            if not legal_moves(other, own):
+                return own.bit_count() - other.bit_count()
+            return -self.solve_node(other, own, -beta, -alpha)
+        best = -65
+        for sq in self.solve_order(own, other, moves):
+            f = flips(own, other, sq)
+            i = empties.index(sq)
+            del empties[i]
+            v = -self.solve_node(other & ~f, own | f | (1 << sq),
+                                 -beta, -alpha)
+            empties.insert(i, sq)
+            if self.stopped:
+                return 0
+            if v > best:
+                best = v
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta:
+                        break
+        return best
+
+
+# State of a parallel search worker process, set up by _init_worker, and
+# the root search its transposition table was last aged for
+_shared_alpha = None
+_cancel = None
+_worker_tt = None
+_worker_search = None
+
+
+def _init_worker(alpha, cancel, tt_megabytes):
+    global _shared_alpha, _cancel, _worker_tt, _worker_search
+    _shared_alpha = alpha
+    _cancel = cancel
+    _worker_tt = TranspositionTable(tt_megabytes)
+    _worker_search = None
+
+
+def _search_root_move(cls, black, white, player, pos, depth, deadline,
+                      root):
+    # Search one root move in a worker process until `deadline`, a
+    # time.time() value, if given. Return its score, the alpha bound it
+    # was searched with (scores not above it are only upper bounds) and the
+    # node count; the score is None if time ran out or the search was
+    # cancelled. The board is rebuilt as an instance of `cls`. `root`
+    # numbers the root searches, so that the transposition table ages its
+    # entries once per root search as a serial search's does.
+    global _worker_search
+    if root != _worker_search:
+        _worker_search = root
+        _worker_tt.new_search()
+    board = cls.from_bitmasks(black, white)
+    search = Search(board, _worker_tt, stop=_cancel)
+    if deadline is not None:
+        # The deadline is set when the move is handed to the pool, so that
+        # moves waiting for a worker don't get the whole budget again
+        search.deadline = time.perf_counter() + deadline - time.time()
+    board.make_move(player, pos)
+    alpha = _shared_alpha.value
+    v = -search.negamax(opp(player), depth - 1, -math.inf, -alpha, 1)
+    if search.stopped:
+        return (None, alpha, search.nodes)
+    with _shared_alpha.get_lock():
+        if v > _shared_alpha.value:
+            _shared_alpha.value = v
+    return (v, alpha, search.nodes)
+
+
+class ParallelSearch:
+    # Splits the root moves of a search across a pool of worker processes.
+    # Each root move is searched with the best root score found by the time
+    # its search starts as alpha (a bound that is not tightened while it
+    # runs), and the move picked is the one a serial Search picks at equal
+    # depth.
+
+    def __init__(self, workers=None, tt_megabytes=16):
+        self.workers = workers or os.cpu_count()
+        self.alpha = multiprocessing.Value('d', -math.inf)
+        self.cancel = multiprocessing.Event()
+        self.pool = ProcessPoolExecutor(
+            self.workers, initializer=_init_worker,
+            initargs=(self.alpha, self.cancel, tt_megabytes))
+        self.nodes = 0
+        self.depth = 0
+        self.searches = 0
+
+    def __deepcopy__(self, memo):
+        # Snapshots of a game share its worker pool
+        return self
+
+    def close(self):
+        self.pool.shutdown()
+
+    def best_move(self, board, player, depth, budget_ms=None, hint=None,
+                  stop=None):
+        # Return the best move at `depth`, or None if time ran out or the
+        # `stop` event was set
+        moves = board.avl_moves(player)
+        if not moves:
+            return None
+        # Search the root moves in the order the serial search does, so
+        # that ties between equal scores are broken the same way
+        Search(board).order(moves, 0, hint)
+        (black, white) = board.bitmasks()
+        self.alpha.value = -math.inf
+        deadline = None
+        if budget_ms is not None:
+            deadline = time.time() + budget_ms / 1000
+        futures = [self.pool.submit(_search_root_move, type(board), black,
+                                    white, player, pos, depth, deadline,
+                                    self.searches)
+                   for pos in moves]
+        if stop is not None:
+            # Pass a stop request on to the workers, and drop the moves
+            # they have not started on
+            while wait(futures, 0.005).not_done:
+                if stop.is_set():
+                    self.cancel.set()
+                    for future in futures:
+                        future.cancel()
+                    break
+        results = [future.result() for future in futures
+                   if not future.cancelled()]
+        self.cancel.clear()
+        self.nodes += sum(nodes for (v, alpha, nodes) in results)
+        if len(results) < len(moves) or \
+                any(v is None for (v, alpha, nodes) in results):
+            return None
+
+        best = max(v for (v, alpha, nodes) in results if v > alpha)
+        chosen = min(i for (i, (v, alpha, nodes)) in enumerate(results)
+                     if v > alpha and v == best)
+        # An earlier move that failed low against an alpha equal to the
+        # best score may tie with it; the serial search would pick it
+        for i in range(chosen):
+            (v, alpha, nodes) = results[i]
+            if v <= alpha and alpha >= best:
+                search = Search(type(board).from_bitmasks(black, white))
+                search.board.make_move(player, moves[i])
+                v = -search.negamax(opp(player), depth - 1,
+                                    -math.inf, math.inf, 1)
+                self.nodes += search.nodes
+                if v == best:
+                    chosen = i
+                    break
+        return moves[chosen]
+
+    def iterate(self, board, player, budget_ms, max_depth=64, stop=None):
+        # Iterative deepening as in Search.iterate, one parallel root
+        # search per depth
+        start = time.perf_counter()
+        moves = board.avl_moves(player)
+        if not moves:
+            return None
+        best_pos = moves[0]
+        if len(moves) == 1:
+            return best_pos
+        self.searches += 1
+        empties = 64 - board.count(BLACK) - board.count(WHITE)
+        for depth in range(1, min(max_depth, empties) + 1):
+            remaining = budget_ms - 1000 * (time.perf_counter() - start)
+            pos = self.best_move(board, player, depth, remaining, best_pos,
+                                 stop)
+            if pos is None:
+                break
+            best_pos = pos
+            self.depth = depth
+            if time.perf_counter() - start > budget_ms / 2000:
+                break
+        return best_pos
+
+
+BACKENDS = {
+    'list': Board,
+    'bitboard': BitBoard,
+    'pattern': PatternBoard
+}
+
+# Thinking time in milliseconds of each difficulty level
+LEVELS = {
+    'medium': 100,
+    'hard': 1000
+}
+
+# Positions with at most this many empty squares are solved exactly, by
+# the smallest thinking time that can afford it: the solver takes up to
+# about 30ms at 8 empties, 160ms at 11 and a second or more at 12
+ENDGAME_EMPTIES = [
+    (1000, 11),
+    (100, 8),
+    (0, 6)
+]
+
+
+# Move log codes: the square, 8 * x + y, or MOVE_PASS, plus MOVE_WHITE for
+# white's moves
+MOVE_PASS = 64
+MOVE_WHITE = 128
 
 
 class Game():
     # Represents a human-vs-computer game of Reversi
 
-    def __init__(self, human=None, algorithm=None):
-        self.board = Board()
+    def __init__(self, human=None, algorithm=None, backend='bitboard',
+                 tt_megabytes=16, workers=1, endgame_empties=None,
+                 collect_stats=False, book=None, move_cache_size=1 << 16):
+        self.board = BACKENDS[backend]()
         self.human = human
         self.computer = opp(human)
         self.player = BLACK
         self.algorithm = algorithm
+        self.backend = backend
+        self.tt = TranspositionTable(tt_megabytes)
+        # Searches run on a pool of this many processes when above 1
+        self.workers = workers
+        self.parallel = None
+        self.mcts = None
+        # Positions with this many empty squares or fewer are solved
+        # exactly; by default it depends on the thinking time (see
+        # ENDGAME_EMPTIES)
+        self.endgame_empties = endgame_empties
+        # With collect_stats, each get_move fills in a new SearchStats here,
+        # which can be read while the search runs
+        self.collect_stats = collect_stats
+        self.stats = None
+        # Opening book (see book.py) consulted before searching
+        self.book = book
+        # Replies worked out by ponder(), by position key
+        self.pondered = {}
+        # Move log: one byte per ply (see MOVE_PASS and MOVE_WHITE) and the
+        # discs each move flipped. Entries from `ply` on have been undone
+        # and can be redone.
+        self.codes = array('B')
+        self.flips = array('Q')
+        self.ply = 0
+        # Legal moves, disc counts and whether the game is over, worked out
+        # once per position (see state())
+        self.known = None
+        self.state_hits = self.state_misses = 0
+        # Legal moves of up to move_cache_size positions the computer's
+        # searches meet, kept from move to move; none are kept when it is 0
+        self.move_cache = None
+        if move_cache_size:
+            self.move_cache = MoveCache(move_cache_size)
 
-    def get_move(self):
+    def get_move(self, stop=None):
+        # Return the computer's move, or None if the `stop` event was set
+        # before the search finished
+        stats = None
+        if self.collect_stats:
+            stats = self.stats = SearchStats()
+        # A reply found while pondering on the human's time is played at
+        # once
+        key = self.board.hash ^ (ZOBRIST_WHITE if self.computer == WHITE
+                                 else 0)
+        pos = self.pondered.get(key)
+        self.pondered = {}
+        if pos is not None:
+            return pos
+        # Search a copy, so that the board can be read (and drawn) while
+        # the computer thinks
+        board = deepcopy(self.board)
+        board.cache = self.move_cache
+        pos = self.think(board, stop, stats)
+        if stop is not None and stop.is_set():
+            return None
+        return pos
+
+    def think(self, board, stop=None, stats=None):
+        # Return the computer's move on `board`. Besides the named levels,
+        # the algorithm may be 'depth:N' for a fixed-depth search,
+        # 'time:MS' for a custom time budget, or Monte Carlo tree search
+        # with 'mcts' (one second), 'mcts:MS' or 'playouts:N'. Setting the
+        # `stop` event makes the search give up early.
         if self.algorithm == 'easy':
-            return self.board.gen_basic_move(self.computer)
-        elif self.algorithm == 'medium':
-            return self.board.gen_minimax_move(self.computer, 3)
-        elif self.algorithm == 'hard':
-            return self.board.gen_minimax_move(self.computer, 4)
+            return board.gen_basic_move(self.computer)
+        if self.book is not None:
+            pos = self.book.lookup(board, self.computer)
+            if pos is not None:
+                return pos
+        if self.mcts_algorithm():
+            return self.think_mcts(board, stop, stats)
+        if self.algorithm.startswith('depth:'):
+            self.tt.new_search()
+            return Search(board, self.tt, stats=stats, stop=stop).best_move(
+                self.computer, int(self.algorithm[6:]))
+        elif self.algorithm in LEVELS or self.algorithm.startswith('time:'):
+            if self.algorithm in LEVELS:
+                budget = LEVELS[self.algorithm]
+            else:
+                budget = int(self.algorithm[5:])
+            empties = 64 - board.count(BLACK) - board.count(WHITE)
+            limit = self.endgame_empties
+            if limit is None:
+                limit = next(n for (ms, n) in ENDGAME_EMPTIES if budget >= ms)
+            if empties <= limit:
+                # The solver gets three quarters of the time, so that if it
+                # runs out the heuristic search still has a real budget
+                solve_budget = budget * 3 / 4
+                (pos, score) = Search(board, stats=stats, stop=stop).solve(
+                    self.computer, solve_budget)
+                if pos is not None or (stop is not None and stop.is_set()):
+                    return pos
+                budget -= solve_budget
+            if self.workers > 1:
+                if self.parallel is None:
+                    self.parallel = ParallelSearch(self.workers)
+                nodes = self.parallel.nodes
+                pos = self.parallel.iterate(board, self.computer, budget,
+                                            stop=stop)
+                if stats is not None:
+                    stats.nodes += self.parallel.nodes - nodes
+                    stats.depth = self.parallel.depth
+                return pos
+            self.tt.new_search()
+            return Search(board, self.tt, stats=stats, stop=stop).iterate(
+                self.computer, budget)
+        else:
+            raise ValueError('unknown algorithm: {}'.format(self.algorithm))
+
+    def mcts_algorithm(self):
+        return self.algorithm == 'mcts' or \
+            self.algorithm.startswith(('mcts:', 'playouts:'))
+
+    def think_mcts(self, board, stop=None, stats=None):
+        if self.mcts is None:
+            # Imported here as mcts.py itself imports this module
+            import mcts
+            self.mcts = mcts.MCTS(self.workers)
+        (budget, playouts) = (1000, None)
+        if self.algorithm.startswith('mcts:'):
+            budget = int(self.algorithm[5:])
+        elif self.algorithm.startswith('playouts:'):
+            (budget, playouts) = (None, int(self.algorithm[9:]))
+        before = self.mcts.playouts
+        pos = self.mcts.best_move(board, self.computer, budget, playouts,
+                                  stop)
+        if stats is not None:
+            stats.nodes += self.mcts.playouts - before
+        return pos
+
+    def ponder(self, stop):
+        # Run while the human is to move, until the `stop` event is set:
+        # work out the computer's answer to each human move, likeliest
+        # first, so that get_move can play it at once. The searches also
+        # fill the transposition table.
+        # Monte Carlo tree search reuses its tree between moves instead
+        if self.algorithm == 'easy' or self.mcts_algorithm():
+            return
+        board = deepcopy(self.board)
+        board.cache = self.move_cache
+        moves = board.avl_moves(self.human)
+        hint = self.tt.best_move(
+            board.hash ^ (ZOBRIST_WHITE if self.human == WHITE else 0))
+        Search(board).order(moves, 0, hint)
+        for pos in moves:
+            if stop.is_set():
+                return
+            flipped = board.make_move(self.human, pos)
+            key = board.hash ^ (ZOBRIST_WHITE if self.computer == WHITE
+                                else 0)
+            if key not in self.pondered and board.avl_moves(self.computer):
+                reply = self.think(board, stop)
+                if not stop.is_set() and reply is not None:
+                    self.pondered[key] = reply
+            board.unmake_move(self.human, pos, flipped)
 
     def move(self, pos):
-        self.board.move(self.player, pos)
+        (x, y) = pos
+        code = 8 * x + y
+        if self.player == WHITE:
+            code |= MOVE_WHITE
+        self.log(code, self.board.make_move(self.player, pos))
 
     def switch_turn(self):
+        # A player who hands over the turn without having moved passes
+        if self.player == WHITE:
+            moved = self.ply and self.codes[self.ply - 1] & MOVE_WHITE
+        else:
+            moved = self.ply and not self.codes[self.ply - 1] & MOVE_WHITE
+        if not moved:
+            code = MOVE_PASS
+            if self.player == WHITE:
+                code |= MOVE_WHITE
+            self.log(code, 0)
         self.player = opp(self.player)
 
-    def is_over(self):
-        if not self.board.avl_moves(BLACK) and not self.board.avl_moves(WHITE):
-            return True
-        else:
+    def log(self, code, flipped):
+        del self.codes[self.ply:]
+        del self.flips[self.ply:]
+        self.codes.append(code)
+        self.flips.append(flipped)
+        self.ply += 1
+
+    def undo(self):
+        # Take back the last move or pass; the player who made it is to
+        # move again. Return False if there is nothing to undo.
+        if not self.ply:
             return False
+        self.ply -= 1
+        code = self.codes[self.ply]
+        self.player = WHITE if code & MOVE_WHITE else BLACK
+        if not code & MOVE_PASS:
+            sq = code & 63
+            self.board.unmake_move(self.player, POSITIONS[sq],
+                                   self.flips[self.ply])
+        return True
+
+    def redo(self):
+        # Play the next undone move or pass again. Return False if there is
+        # nothing to redo.
+        if self.ply == len(self.codes):
+            return False
+        code = self.codes[self.ply]
+        self.player = WHITE if code & MOVE_WHITE else BLACK
+        if not code & MOVE_PASS:
+            self.board.make_move(self.player, POSITIONS[code & 63])
+        self.ply += 1
+        self.player = opp(self.player)
+        return True
+
+    def history(self):
+        # Return the moves played so far as (player, pos) pairs, with None
+        # for pos on a pass
+        result = []
+        for code in self.codes[:self.ply]:
+            player = WHITE if code & MOVE_WHITE else BLACK
+            if code & MOVE_PASS:
+                result.append((player, None))
+            else:
+                result.append((player, POSITIONS[code & 63]))
+        return result
+
+    def transcript(self):
+        # Return the moves played so far as a string such as 'f5d6c3',
+        # passes left out
+        return ''.join(square_name(pos) for (player, pos) in self.history()
+                       if pos is not None)
+
+    def state(self):
+        # Return (moves, counts, over) of the current position: the legal
+        # moves and disc counts of each player and whether the game is
+        # over. They are worked out again only once the discs have changed,
+        # so that the UI can ask for them every frame.
+        key = self.board.bitmasks()
+        known = self.known
+        if known is not None and known[0] == key:
+            self.state_hits += 1
+            return known[1]
+        self.state_misses += 1
+        board = self.board
+        moves = {BLACK: board.avl_moves(BLACK), WHITE: board.avl_moves(WHITE)}
+        counts = {BLACK: board.count(BLACK), WHITE: board.count(WHITE)}
+        state = (moves, counts, not moves[BLACK] and not moves[WHITE])
+        self.known = (key, state)
+        return state
+
+    def hit_rates(self):
+        # Return the hit rates of the position caches
+        lookups = self.state_hits + self.state_misses
+        return {
+            'state': self.state_hits / lookups if lookups else 0.0,
+            'moves': (self.move_cache.hit_rate()
+                      if self.move_cache is not None else 0.0),
+            'tt': self.tt.hit_rate()
+        }
+
+    def empties(self):
+        counts = self.state()[1]
+        return 64 - counts[BLACK] - counts[WHITE]
+
+    def is_over(self):
+        return self.state()[2]
+
+    def close(self):
+        # Shut down the worker processes of parallel searches
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+        if self.mcts is not None:
+            self.mcts.close()
+            self.mcts = None
 
     def avl_moves(self):
-        return self.board.avl_moves(self.player)
+        return list(self.state()[0][self.player])
 
     def is_valid(self, pos):
-        return self.board.is_valid(self.player, pos)
+        return pos in self.state()[0][self.player]
 
     def winner(self):
-        if self.board.count(WHITE) > self.board.count(BLACK):
+        counts = self.state()[1]
+        if counts[WHITE] > counts[BLACK]:
             return WHITE
-        elif self.board.count(WHITE) < self.board.count(BLACK):
+        elif counts[WHITE] < counts[BLACK]:
             return BLACK
         else:
             return None
 
     def score(self, player):
-        return self.board.count(player)
+        return self.state()[1][player]
@@ -0,0 +1,373 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+import reversi
+
+
+# Protocol: one JSON object per line each way. Every request has an "op"
+# and may have an "id", which is copied into the reply.
+#
+#   {"op": "new", "human": "black", "algorithm": "medium"}
+#   {"op": "move", "session": 1, "square": "d3", "budget_ms": 200}
+#   {"op": "state", "session": 1}
+#   {"op": "close", "session": 1}
+#   {"op": "stats"}
+#
+# "new", "move" and "state" reply with the state of the game (see
+# Server.state), "move" also with the computer's replies in "computer".
+# Errors are replied as {"error": message}, and {"error": "busy"} when the
+# engine queue is full.
+
+COLOURS = {
+    'black': reversi.BLACK,
+    'white': reversi.WHITE
+}
+
+# Engines a session may ask for
+ALGORITHMS = ('easy', 'medium', 'hard', 'mcts', 'time:MS', 'mcts:MS')
+
+
+class Busy(Exception):
+    pass
+
+
+# Games a worker process searches with, one per kind of engine ('easy',
+# 'time' or 'mcts') whatever the thinking time, so that each keeps its
+# transposition table (or search tree) from move to move
+_worker_games = {}
+
+
+def _init_worker():
+    # Close the worker's games when its process exits
+    util.Finalize(None, _close_worker_games, exitpriority=10)
+
+
+def _close_worker_games():
+    for game in _worker_games.values():
+        game.close()
+    _worker_games.clear()
+
+
+def _engine_move(black, white, player, algorithm):
+    kind = algorithm.split(':')[0]
+    game = _worker_games.get(kind)
+    if game is None:
+        game = _worker_games[kind] = reversi.Game(
+            human=reversi.opp(player), algorithm=algorithm)
+    game.algorithm = algorithm
+    game.human = reversi.opp(player)
+    game.computer = player
+    game.board = reversi.BitBoard.from_bitmasks(black, white)
+    game.player = player
+    return game.get_move()
+
+
+def engine(algorithm, budget_ms, max_budget_ms):
+    # Return the algorithm to search with: `algorithm` with its thinking
+    # time replaced by `budget_ms` if given, and capped at `max_budget_ms`
+    if algorithm == 'easy':
+        return algorithm
+    if algorithm in reversi.LEVELS:
+        (kind, budget) = ('time', reversi.LEVELS[algorithm])
+    elif algorithm == 'mcts':
+        (kind, budget) = ('mcts', 1000)
+    else:
+        (kind, budget) = algorithm.split(':')
+        budget = int(budget)
+    if budget_ms is not None:
+        budget = int(budget_ms)
+    return '{}:{}'.format(kind, max(1, min(budget, max_budget_ms)))
+
+
+def valid_algorithm(algorithm):
+    if not isinstance(algorithm, str):
+        return False
+    if algorithm in ('easy', 'mcts') or algorithm in reversi.LEVELS:
+        return True
+    (kind, sep, budget) = algorithm.partition(':')
+    return kind in ('time', 'mcts') and budget.isdigit()
+
+
+class Session:
+    def __init__(self, human, algorithm):
+        # The session's own game needs no transposition table or move
+        # cache: searches run in the worker processes
+        self.game = reversi.Game(human=human, algorithm=algorithm,
+                                 tt_megabytes=0, move_cache_size=0)
+        self.lock = asyncio.Lock()
+
+
+class Server:
+    # Serves many games at once. Engine searches run on a pool of worker
+    # processes; at most `workers` are handed to the pool at a time and up
+    # to `max_queue` more wait for it, beyond which requests are refused
+    # as busy. Each connection may have up to `pipeline` requests in
+    # progress before the server stops reading from it.
+
+    def __init__(self, workers=None, max_queue=1000, max_budget_ms=5000,
+                 pipeline=64):
+        self.workers = workers or os.cpu_count()
+        self.max_queue = max_queue
+        self.max_budget_ms = max_budget_ms
+        self.pipeline = pipeline
+        self.pool = ProcessPoolExecutor(self.workers,
+                                        initializer=_init_worker)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.sessions = {}
+        self.next_session = 1
+        self.connections = 0
+        # Searches waiting for a pool slot, and searches in the pool
+        self.queued = 0
+        self.running = 0
+        self.moves = 0
+        self.rejected = 0
+
+    def close(self):
+        self.pool.shutdown()
+
+    def stats(self):
+        return {
+            'sessions': len(self.sessions),
+            'connections': self.connections,
+            'queue_depth': self.queued,
+            'running': self.running,
+            'moves': self.moves,
+            'rejected': self.rejected
+        }
+
+    def admit(self):
+        # Refuse a request that would need a search while the queue is
+        # full, before it changes anything
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise Busy()
+
+    async def engine_move(self, game, budget_ms):
+        if game.algorithm == 'easy':
+            # Cheaper than handing it to a worker
+            return game.get_move()
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            (black, white) = game.board.bitmasks()
+            algorithm = engine(game.algorithm, budget_ms, self.max_budget_ms)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.pool, _engine_move, black, white, game.player, algorithm)
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+    async def play_computer(self, game, budget_ms):
+        # Play the computer's moves, and pass for whoever cannot move, until
+        # the human is to move or the game is over; return the squares
+        # played
+        played = []
+        while not game.is_over():
+            if not game.avl_moves():
+                game.switch_turn()
+            elif game.player == game.human:
+                break
+            else:
+                pos = await self.engine_move(game, budget_ms)
+                game.move(pos)
+                game.switch_turn()
+                played.append(reversi.square_name(pos))
+                self.moves += 1
+        return played
+
+    def state(self, sid):
+        game = self.sessions[sid].game
+        cells = []
+        for sq in range(64):
+            disc = game.board.get(reversi.POSITIONS[sq])
+            cells.append('x' if disc == reversi.BLACK else
+                         'o' if disc == reversi.WHITE else '.')
+        return {
+            'session': sid,
+            'board': ''.join(cells),
+            'player': 'black' if game.player == reversi.BLACK else 'white',
+            'moves': [reversi.square_name(pos) for pos in game.avl_moves()],
+            'over': game.is_over(),
+            'black': game.score(reversi.BLACK),
+            'white': game.score(reversi.WHITE),
+            'transcript': game.transcript()
+        }
+
+    def session(self, request):
+        sid = request.get('session')
+        if not isinstance(sid, int) or sid not in self.sessions:
+            raise ValueError('unknown session: {}'.format(sid))
+        return sid
+
+    def budget(self, request):
+        # Return the thinking time a request asks for, or None
+        budget_ms = request.get('budget_ms')
+        if budget_ms is None:
+            return None
+        if isinstance(budget_ms, bool) or \
+                not isinstance(budget_ms, (int, float)) or \
+                not math.isfinite(budget_ms) or budget_ms < 0:
+            raise ValueError('budget_ms must be a number of milliseconds')
+        return int(budget_ms)
+
+    async def dispatch(self, request, owned):
+        op = request.get('op')
+        if op == 'new':
+            human = request.get('human', 'black')
+            algorithm = request.get('algorithm', 'medium')
+            if human not in ('black', 'white'):
+                raise ValueError('human must be black or white')
+            if not valid_algorithm(algorithm):
+                raise ValueError('algorithm must be one of {}'.format(
+                    ', '.join(ALGORITHMS)))
+            budget_ms = self.budget(request)
+            self.admit()
+            sid = self.next_session
+            self.next_session += 1
+            session = self.sessions[sid] = Session(COLOURS[human], algorithm)
+            owned.add(sid)
+            async with session.lock:
+                computer = await self.play_computer(session.game, budget_ms)
+            return dict(self.state(sid), computer=computer)
+        elif op == 'move':
+            sid = self.session(request)
+            budget_ms = self.budget(request)
+            session = self.sessions[sid]
+            async with session.lock:
+                game = session.game
+                pos = reversi.parse_square(str(request.get('square')))
+                if game.player != game.human or pos not in game.avl_moves():
+                    raise ValueError('illegal move: {}'.format(
+                        request.get('square')))
+                self.admit()
+                game.move(pos)
+                game.switch_turn()
+                computer = await self.play_computer(game, budget_ms)
+            return dict(self.state(sid), computer=computer)
+        elif op == 'state':
+            return self.state(self.session(request))
+        elif op == 'close':
+            sid = self.session(request)
+            del self.sessions[sid]
+            owned.discard(sid)
+            return {'session': sid, 'closed': True}
+        elif op == 'stats':
+            return self.stats()
+        raise ValueError('unknown op: {}'.format(op))
+
+    async def respond(self, line, writer, owned, pipeline):
+        # Answer one request; whatever happens, the request's pipeline slot
+        # is given back
+        try:
+            request = {}
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    request = {}
+                    raise ValueError('request must be an object')
+                reply = await self.dispatch(request, owned)
+            except Busy:
+                reply = {'error': 'busy'}
+            except (ValueError, IndexError) as e:
+                reply = {'error': str(e)}
+            except Exception as e:
+                reply = {'error': 'bad request: {}'.format(
+                    type(e).__name__)}
+            if 'id' in request:
+                reply['id'] = request['id']
+            try:
+                writer.write((json.dumps(reply) + '\n').encode())
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            pipeline.release()
+
+    async def handle(self, reader, writer):
+        # Serve one connection; its sessions end with it
+        self.connections += 1
+        pipeline = asyncio.Semaphore(self.pipeline)
+        owned = set()
+        tasks = set()
+        try:
+            while True:
+                await pipeline.acquire()
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(
+                    self.respond(line, writer, owned, pipeline))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for sid in owned:
+                self.sessions.pop(sid, None)
+            self.connections -= 1
+            writer.close()
+
+    async def report(self, seconds):
+        # Print the server's figures every `seconds` seconds
+        while True:
+            await asyncio.sleep(seconds)
+            print(time.strftime('%H:%M:%S'), json.dumps(self.stats()),
+                  flush=True)
+
+
+async def serve(args):
+    server = Server(args.workers, args.max_queue, args.max_budget,
+                    args.pipeline)
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle, args.unix)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle, args.host,
+                                              args.port)
+        where = '{}:{}'.format(args.host, args.port)
+    print('serving on {} with {} workers'.format(where, server.workers),
+          flush=True)
+    if args.report:
+        asyncio.create_task(server.report(args.report))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve games over a line-delimited JSON protocol')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', help='listen on this Unix socket instead')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='engine processes (default: all cores)')
+    parser.add_argument('--max-queue', type=int, default=1000,
+                        help='searches that may wait for a worker')
+    parser.add_argument('--max-budget', type=int, default=5000,
+                        help='longest thinking time allowed, in ms')
+    parser.add_argument('--pipeline', type=int, default=64,
+                        help='requests in progress per connection')
+    parser.add_argument('--report', type=float, default=0,
+                        help='print figures every this many seconds')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,186 @@
+# Author: Ayan Banerjee <ayanb280@gmail.com>
+
+import argparse
+import json
+import math
+import os
+import time
+from multiprocessing import Pool
+import reversi
+
+
+def openings(plies):
+    # Return the move lists of all distinct positions reachable in exactly
+    # `plies` plies from the start, in a fixed order
+    seen = set()
+    result = []
+
+    def expand(board, player, moves):
+        if len(moves) == plies:
+            key = board.bitmasks()
+            if key not in seen:
+                seen.add(key)
+                result.append(list(moves))
+            return
+        avl = board.avl_moves(player)
+        if not avl:
+            return
+        for pos in avl:
+            flipped = board.make_move(player, pos)
+            moves.append(pos)
+            expand(board, reversi.opp(player), moves)
+            moves.pop()
+            board.unmake_move(player, pos, flipped)
+
+    expand(reversi.BitBoard(), reversi.BLACK, [])
+    return result
+
+
+def play_game(spec):
+    # Play one game between two engine configurations from an opening and
+    # return its record
+    (index, opening, black, white) = spec
+    board = reversi.BitBoard()
+    engines = {
+        reversi.BLACK: reversi.Game(human=reversi.WHITE, algorithm=black),
+        reversi.WHITE: reversi.Game(human=reversi.BLACK, algorithm=white)
+    }
+    for engine in engines.values():
+        engine.board = board
+    try:
+        return play_moves(index, opening, black, white, board, engines)
+    finally:
+        for engine in engines.values():
+            engine.close()
+
+
+def play_moves(index, opening, black, white, board, engines):
+    # Play the game out on `board` with a Game per colour in `engines`
+    player = reversi.BLACK
+    moves = []
+    for pos in opening:
+        board.move(player, pos)
+        moves.append(reversi.square_name(pos))
+        player = reversi.opp(player)
+
+    think = {reversi.BLACK: 0.0, reversi.WHITE: 0.0}
+    count = {reversi.BLACK: 0, reversi.WHITE: 0}
+    while True:
+        if not board.avl_moves(player):
+            if not board.avl_moves(reversi.opp(player)):
+                break
+            player = reversi.opp(player)
+            continue
+        start = time.perf_counter()
+        pos = engines[player].get_move()
+        think[player] += time.perf_counter() - start
+        count[player] += 1
+        board.move(player, pos)
+        moves.append(reversi.square_name(pos))
+        player = reversi.opp(player)
+
+    return {
+        'game': index,
+        'black': black,
+        'white': white,
+        'opening': len(opening),
+        'moves': ''.join(moves),
+        'black_discs': board.count(reversi.BLACK),
+        'white_discs': board.count(reversi.WHITE),
+        'black_moves': count[reversi.BLACK],
+        'white_moves': count[reversi.WHITE],
+        'black_time': think[reversi.BLACK],
+        'white_time': think[reversi.WHITE]
+    }
+
+
+def wilson(score, n, z=1.96):
+    # Return the 95% Wilson score interval of a proportion
+    if n == 0:
+        return (0.0, 1.0)
+    p = score / n
+    centre = p + z * z / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return ((centre - spread) / (1 + z * z / n),
+            (centre + spread) / (1 + z * z / n))
+
+
+def run(engine_a, engine_b, games, plies=4, workers=None, out=None):
+    # Play `games` games between two engines, alternating colours on each
+    # opening, and return a summary; the game records go to `out`
+    lines = openings(plies)
+    specs = []
+    for i in range(games):
+        opening = lines[(i // 2) % len(lines)]
+        if i % 2 == 0:
+            specs.append((i, opening, engine_a, engine_b))
+        else:
+            specs.append((i, opening, engine_b, engine_a))
+
+    wins = draws = losses = 0
+    moves = {engine_a: 0, engine_b: 0}
+    think = {engine_a: 0.0, engine_b: 0.0}
+    with Pool(workers or os.cpu_count()) as pool:
+        records = pool.imap_unordered(play_game, specs)
+        for record in records:
+            if out is not None:
+                out.write(json.dumps(record) + '\n')
+            # engine_a plays black in even-numbered games
+            margin = record['black_discs'] - record['white_discs']
+            if record['game'] % 2:
+                margin = -margin
+            if margin > 0:
+                wins += 1
+            elif margin < 0:
+                losses += 1
+            else:
+                draws += 1
+            for colour in ('black', 'white'):
+                moves[record[colour]] += record[colour + '_moves']
+                think[record[colour]] += record[colour + '_time']
+
+    score = wins + draws / 2
+    return {
+        'engines': [engine_a, engine_b],
+        'games': games,
+        'wins': wins,
+        'draws': draws,
+        'losses': losses,
+        'score': score / games if games else 0.0,
+        'interval': wilson(score, games),
+        'moves_per_second': {
+            engine: moves[engine] / think[engine] if think[engine] else 0.0
+            for engine in moves
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Play two engine configurations against each other')
+    parser.add_argument('engine_a',
+                        help="'easy', 'medium', 'hard', 'depth:N', "
+                             "'time:MS', 'mcts', 'mcts:MS' or "
+                             "'playouts:N'")
+    parser.add_argument('engine_b')
+    parser.add_argument('-n', '--games', type=int, default=20)
+    parser.add_argument('--plies', type=int, default=4,
+                        help='length of the opening lines to start from')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('-o', '--out', default='tournament.jsonl',
+                        help='file to write the game records to')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.out, 'w') as out:
+        summary = run(args.engine_a, args.engine_b, args.games, args.plies,
+                      args.workers, out)
+    (low, high) = summary['interval']
+    print('{} vs {}: +{} ={} -{} in {:.1f}s'.format(
+        args.engine_a, args.engine_b, summary['wins'], summary['draws'],
+        summary['losses'], time.perf_counter() - start))
+    print('score of {}: {:.1%} (95% CI {:.1%} - {:.1%})'.format(
+        args.engine_a, summary['score'], low, high))
+    for (engine, rate) in summary['moves_per_second'].items():
+        print('{}: {:.1f} moves/s'.format(engine, rate))